@@ -26,14 +26,23 @@
 
 # Imports ----------------------------------------------------------------------
 
+import array
 import ast
+import bisect
+import collections
+import concurrent.futures
+import errno
 import io
 import itertools
+import json
 import math
 import os
 import re
 import struct
+import threading
+import time
 import traceback
+import zlib
 
 # Common attributes ------------------------------------------------------------
 
@@ -66,6 +75,59 @@ dashboards but only works with certain terminals.''',
                 'default': True,
                 'type': bool
             },
+            'render_threads': {
+                'doc': '''Number of threads used to format the external outputs.
+
+Modules collect their data in the GDB thread, then the content of the external
+outputs (see `dashboard -output`) is formatted and written in background so
+that the prompt is given back as soon as possible. With 0 everything happens in
+the GDB thread.''',
+                'default': 0,
+                'type': int,
+                'check': check_ge_zero
+            },
+            'coalesce_stops': {
+                'doc': '''Only render the last stop before the prompt.
+
+When enabled the dashboard is rendered when GDB is about to show the prompt
+instead of at every stop, so the intermediate stops of a command script (e.g.,
+a `while` loop of `stepi`) are not rendered at all. It has no effect if the
+`before_prompt` event is not supported by this GDB version.
+
+Do not enable it when no prompt is ever shown (e.g., `gdb -batch` or MI front
+ends), otherwise the dashboard is never rendered.''',
+                'default': False,
+                'type': bool
+            },
+            'render_delay': {
+                'doc': '''Milliseconds within which consecutive stops are coalesced.
+
+If a stop happens within this time since the previous render (e.g., when
+keeping Enter pressed to repeat `next`), the render is postponed until the
+delay expires and it is dropped if the execution resumes in the meantime, so
+that only the last stop is rendered. Postponed renders are written after the
+prompt. Requires `coalesce_stops`, with 0 every stop is rendered.''',
+                'default': 0,
+                'type': int,
+                'check': check_ge_zero
+            },
+            'profile_stops': {
+                'doc': 'Number of stops kept by the profiler (see `dashboard -profile`).',
+                'default': 100,
+                'type': int,
+                'check': check_gt_zero
+            },
+            'incremental_render': {
+                'doc': '''Only redraw the lines that changed since the previous redraw.
+
+This applies to external outputs (see `dashboard -output`) only, the main
+terminal is always redrawn in full as GDB messages are interleaved with the
+dashboard. Changed lines are rewritten in place using cursor addressing, the
+whole screen is redrawn when the geometry changes or when the content does not
+fit the terminal.''',
+                'default': False,
+                'type': bool
+            },
             # values formatting
             'compact_values': {
                 'doc': 'Display complex objects in a single line.',
@@ -285,11 +347,254 @@ def to_string(value):
         value_string = ansi(e, R.style_error)
     return value_string
 
+# hexadecimal representation of every byte value
+HEX_BYTES = tuple('{:02x}'.format(byte) for byte in range(256))
+
+def format_bytes(data, separator=' '):
+    return separator.join([HEX_BYTES[byte] for byte in bytearray(data)])
+
 def format_address(address):
-    pointer_size = gdb.parse_and_eval('$pc').type.sizeof
+    pointer_size = stop_context().pointer_size()
     return ('0x{{:0{}x}}').format(pointer_size * 2).format(address)
 
-def format_value(value, compact=None):
+class BudgetedFormatter():
+    '''Single-line value formatter bounded by a character budget.
+
+    Values are walked lazily, pretty-printer children included, and the walk
+    stops as soon as the budget is exhausted, so that huge values (e.g.,
+    containers with millions of elements with `print elements 0`) are never
+    stringified in full.'''
+
+    class Exhausted(Exception):
+        def __init__(self):
+            # number of the omitted elements of the innermost array, if known
+            self.omitted = None
+
+    # size of the memory blocks read to find the repeated elements
+    BLOCK = 4096
+
+    def __init__(self, budget, format_letter=None):
+        self.budget = budget
+        self.format_letter = format_letter
+        self.pieces = []
+        self.length = 0
+        self.elements = 0
+        # last memory block read (address, bytes)
+        self.block = (0, b'')
+
+    def format(self, value):
+        # return the formatted value, exceeding the budget if truncated, and
+        # the number of omitted elements, if known
+        try:
+            self.walk(value)
+            return ''.join(self.pieces), None
+        except BudgetedFormatter.Exhausted as e:
+            return ''.join(self.pieces), e.omitted
+        except Exception as e:
+            # e.g., inaccessible memory while walking or broken pretty printers
+            return ''.join(self.pieces) + ansi(e, R.style_error), None
+
+    def emit(self, string):
+        self.pieces.append(string)
+        self.length += len(string)
+        if self.length > self.budget:
+            raise BudgetedFormatter.Exhausted()
+
+    def count_element(self):
+        # elements are accounted too since they may be formatted as empty
+        self.elements += 1
+        if self.elements > self.budget:
+            raise BudgetedFormatter.Exhausted()
+
+    def walk(self, value):
+        if not isinstance(value, gdb.Value):
+            self.emit(str(value))
+            return
+        visualizer = gdb.default_visualizer(value)
+        if visualizer:
+            self.walk_printer(visualizer)
+            return
+        value_type = value.type.strip_typedefs()
+        # show the actual object as GDB does (see `print object`)
+        if value_type.code == gdb.TYPE_CODE_STRUCT and stop_context().print_setting('print object'):
+            dynamic_type = value.dynamic_type
+            if dynamic_type != value.type:
+                value = value.cast(dynamic_type)
+                value_type = dynamic_type.strip_typedefs()
+        if value_type.code == gdb.TYPE_CODE_ARRAY and value_type.target().sizeof > 1:
+            self.walk_array(value, value_type)
+        elif value_type.code in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION):
+            self.walk_struct(value, value_type)
+        else:
+            # scalars, pointers and strings
+            self.emit(self.format_leaf(value))
+
+    def walk_array(self, value, value_type):
+        low, high = value_type.range()
+        # runs of equal scalars are collapsed as GDB does (see `print repeats`)
+        # comparing their bytes, which requires the array to be in memory
+        threshold = stop_context().repeat_threshold()
+        indexes = stop_context().print_setting('print array-indexes')
+        target = value_type.target()
+        address = None
+        if threshold and value.address is not None and high >= low and \
+                target.strip_typedefs().code not in (gdb.TYPE_CODE_ARRAY, gdb.TYPE_CODE_STRUCT,
+                                                     gdb.TYPE_CODE_UNION) and \
+                not gdb.default_visualizer(value[low]):
+            address = int(value.address)
+        self.emit('{')
+        index = low
+        while index <= high:
+            # last element shown so far
+            last = index
+            try:
+                self.count_element()
+                if index > low:
+                    self.emit(', ')
+                if indexes:
+                    self.emit('[{}] = '.format(index))
+                self.walk(value[index])
+                repeats = 1
+                if address is not None:
+                    # the run is scanned only as far as the remaining budget
+                    # (but enough to reach the threshold) so that huge arrays
+                    # are not read in full
+                    limit = max(self.budget - self.length, threshold + 1)
+                    element_address = address + (index - low) * target.sizeof
+                    end = address + (high - low + 1) * target.sizeof
+                    end = min(end, element_address + (limit + 1) * target.sizeof)
+                    repeats = self.count_repeats(element_address, target.sizeof, end)
+                # GDB collapses the runs longer than the threshold
+                if address is not None and repeats > limit:
+                    # the end of the run is not known
+                    self.emit(' <repeats {}+ times>...'.format(limit))
+                    break
+                elif address is not None and repeats > threshold:
+                    last = index + repeats - 1
+                    self.emit(' <repeats {} times>'.format(repeats))
+                    index += repeats
+                else:
+                    index += 1
+            except BudgetedFormatter.Exhausted as e:
+                if e.omitted is None:
+                    e.omitted = high - last
+                raise
+        self.emit('}')
+
+    def count_repeats(self, address, size, end):
+        # return the number of consecutive elements equal to the one at the
+        # given address, up to the given end
+        first = self.read(address, size, end)
+        count = 1
+        # check the next element alone first as most of the times it differs
+        length = 1
+        while address + count * size < end:
+            length = min(length, (end - address) // size - count)
+            data = self.read(address + count * size, length * size, end)
+            if data == first * length:
+                count += length
+                length = max(BudgetedFormatter.BLOCK // size, 1)
+                continue
+            for offset in range(0, len(data), size):
+                if data[offset:offset + size] != first:
+                    return count + offset // size
+        return count
+
+    def read(self, address, length, end):
+        # read from the last block if possible since the elements are compared
+        # in order
+        start, block = self.block
+        if not start <= address or address + length > start + len(block):
+            start = address
+            block = bytes(read_memory(address, min(max(length, BudgetedFormatter.BLOCK), end - address)))
+            self.block = (start, block)
+        return block[address - start:address - start + length]
+
+    def walk_struct(self, value, value_type):
+        fields = value_type.fields()
+        # let GDB print the static members (see `print static-members`) as
+        # they need the detection of the recursive types
+        if stop_context().print_setting('print static-members') and \
+                any(not hasattr(field, 'bitpos') for field in fields):
+            self.emit(self.format_leaf(value))
+            return
+        self.emit('{')
+        first = True
+        for field in fields:
+            if not hasattr(field, 'bitpos'):
+                continue
+            if not first:
+                self.emit(', ')
+            first = False
+            if field.is_base_class:
+                self.emit('<{}> = '.format(field.name))
+            elif field.name:
+                self.emit('{} = '.format(field.name))
+            self.walk(value[field])
+        self.emit('}')
+
+    def walk_printer(self, printer):
+        hint = printer.display_hint() if hasattr(printer, 'display_hint') else None
+        string = printer.to_string() if hasattr(printer, 'to_string') else None
+        if hasattr(string, 'value') and not isinstance(string, gdb.Value):
+            # lazy string
+            string = string.value()
+        if isinstance(string, gdb.Value):
+            self.walk(string)
+        elif string is not None:
+            self.emit('"{}"'.format(string) if hint == 'string' else str(string))
+        if not hasattr(printer, 'children'):
+            return
+        if string is not None:
+            self.emit(' = ')
+        self.emit('{')
+        # children are consumed lazily
+        for index, (name, child) in enumerate(printer.children()):
+            if hint == 'map':
+                if index % 2 == 0:
+                    self.count_element()
+                    self.emit(', [' if index else '[')
+                    self.walk(child)
+                    self.emit('] = ')
+                else:
+                    self.walk(child)
+            else:
+                self.count_element()
+                if index:
+                    self.emit(', ')
+                if hint != 'array':
+                    self.emit('{} = '.format(name))
+                self.walk(child)
+        self.emit('}')
+
+    def format_leaf(self, value):
+        # let GDB bound the strings too (Value.format_string() is a recent
+        # addition)
+        options = {'max_elements': max(self.budget - self.length, 1)}
+        if self.format_letter:
+            options['format'] = self.format_letter
+        try:
+            return value.format_string(**options)
+        except AttributeError:
+            return to_string(value)
+        except gdb.error as e:
+            return ansi(e, R.style_error)
+
+def format_value_string(value, compact, budget, format_letter=None):
+    # return the formatted value and the number of omitted elements, if known,
+    # use the budgeted formatter only for single-line values
+    if budget > 0 and compact:
+        return BudgetedFormatter(budget, format_letter).format(value)
+    if format_letter:
+        try:
+            return value.format_string(format=format_letter), None
+        except gdb.error as e:
+            return ansi(e, R.style_error), None
+    return to_string(value), None
+
+def format_value(value, compact=None, format_letter=None):
+    # the optional format letter is the one used by the print command (e.g.,
+    # 'x' for hexadecimal) and requires Value.format_string()
     # format references as referenced values
     # (TYPE_CODE_RVALUE_REF is not supported by old GDB)
     if value.type.code in (getattr(gdb, 'TYPE_CODE_REF', None),
@@ -298,8 +603,9 @@ def format_value(value, compact=None):
             value = value.referenced_value()
         except gdb.error as e:
             return ansi(e, R.style_error)
-    # format the value
-    out = to_string(value)
+    # format the value within the budget
+    compact = compact is not None and compact or R.compact_values
+    out, omitted = format_value_string(value, compact, R.max_value_length, format_letter)
     # dereference up to the actual value if requested
     if R.dereference and value.type.code == gdb.TYPE_CODE_PTR:
         while value.type.code == gdb.TYPE_CODE_PTR:
@@ -308,25 +614,33 @@ def format_value(value, compact=None):
             except gdb.error as e:
                 break
         else:
-            formatted = to_string(value)
-            out += '{} {}'.format(ansi(':', R.style_low), formatted)
+            if R.max_value_length <= 0 or len(out) < R.max_value_length:
+                budget = R.max_value_length - len(out) if R.max_value_length > 0 else 0
+                formatted, omitted = format_value_string(value, compact, budget, format_letter)
+                out += '{} {}'.format(ansi(':', R.style_low), formatted)
     # compact the value
-    if compact is not None and compact or R.compact_values:
+    if compact:
         out = re.sub(r'$\s*', '', out, flags=re.MULTILINE)
-    # truncate the value
+    # truncate the value reporting the omitted elements, if known
     if R.max_value_length > 0 and len(out) > R.max_value_length:
-        out = out[0:R.max_value_length] + ansi(R.value_truncation_string, R.style_critical)
+        truncation = R.value_truncation_string
+        if omitted:
+            truncation += ' ({} more)'.format(omitted)
+        out = out[0:R.max_value_length] + ansi(truncation, R.style_critical)
     return out
 
 # XXX parsing the output of `info breakpoints` is apparently the best option
 # right now, see: https://sourceware.org/bugzilla/show_bug.cgi?id=18385
 # XXX GDB version 7.11 (quire recent) does not have the pending field, so
 # fall back to the parsed information
-def fetch_breakpoints(watchpoints=False, pending=False):
-    # fetch breakpoints addresses
+def parse_breakpoints(numbers=None):
+    # fetch breakpoints addresses (optionally just for some breakpoints)
+    command = 'info breakpoints'
+    if numbers:
+        command += ' ' + ' '.join(str(number) for number in numbers)
     parsed_breakpoints = dict()
     catch_what_regex = re.compile(r'([^,]+".*")?[^,]*')
-    for line in run('info breakpoints').split('\n'):
+    for line in run(command).split('\n'):
         # just keep numbered lines
         if not line or not line[0].isdigit():
             continue
@@ -357,45 +671,327 @@ def fetch_breakpoints(watchpoints=False, pending=False):
                 parsed_breakpoints[number] = [], False, ''
         except ValueError:
             pass
-    # fetch breakpoints from the API and complement with address and source
-    # information
-    breakpoints = []
-    # XXX in older versions gdb.breakpoints() returns None
-    for gdb_breakpoint in gdb.breakpoints() or []:
+    return parsed_breakpoints
+
+def fetch_breakpoint_locations(gdb_breakpoint):
+    # use the location API where available (XXX Breakpoint.locations is a
+    # recent addition) and mimic the parsed information
+    locations = gdb_breakpoint.locations
+    if len(locations) == 1:
+        location = locations[0]
+        return [(location.address, gdb_breakpoint.enabled and location.enabled)]
+    addresses = [(None, gdb_breakpoint.enabled)]
+    addresses.extend((location.address, location.enabled) for location in locations)
+    return addresses
+
+def fetch_breakpoint(gdb_breakpoint, parsed):
+    addresses, is_pending, what = parsed
+    is_pending = getattr(gdb_breakpoint, 'pending', is_pending)
+    # add useful fields to the object
+    breakpoint = dict()
+    breakpoint['number'] = gdb_breakpoint.number
+    breakpoint['type'] = gdb_breakpoint.type
+    breakpoint['enabled'] = gdb_breakpoint.enabled
+    breakpoint['location'] = gdb_breakpoint.location
+    breakpoint['expression'] = gdb_breakpoint.expression
+    breakpoint['condition'] = gdb_breakpoint.condition
+    breakpoint['temporary'] = gdb_breakpoint.temporary
+    breakpoint['hit_count'] = gdb_breakpoint.hit_count
+    breakpoint['pending'] = is_pending
+    breakpoint['what'] = what
+    # add addresses and source information
+    breakpoint['addresses'] = []
+    for address, is_enabled in addresses:
+        if address:
+            sal = gdb.find_pc_line(address)
+        breakpoint['addresses'].append({
+            'address': address,
+            'enabled': is_enabled,
+            'file_name': sal.symtab.filename if address and sal.symtab else None,
+            'file_line': sal.line if address else None
+        })
+    return breakpoint
+
+class BreakpointIndex():
+    '''Breakpoints table kept up to date by GDB events.
+
+    Only the breakpoints notified as created or modified are fetched again, and
+    markers can be looked up by address or by source location in constant
+    time. Without the breakpoint events the whole table is fetched every time.'''
+
+    instance = None
+
+    def __init__(self):
+        self.entries = {}  # breakpoint number to breakpoint
+        self.dirty = {}  # breakpoint number to gdb.Breakpoint to be fetched
+        self.stale = True  # everything needs to be fetched
+        self.by_address = {}
+        self.by_line = {}
+        events = ('breakpoint_created', 'breakpoint_modified', 'breakpoint_deleted')
+        self.tracking = all(hasattr(gdb.events, event) for event in events)
+        if self.tracking:
+            gdb.events.breakpoint_created.connect(self.on_change)
+            gdb.events.breakpoint_modified.connect(self.on_change)
+            gdb.events.breakpoint_deleted.connect(self.on_delete)
+            # source information may change when symbols are loaded
+            gdb.events.new_objfile.connect(self.on_objfile)
+            if hasattr(gdb.events, 'clear_objfiles'):
+                gdb.events.clear_objfiles.connect(self.on_objfile)
+
+    @staticmethod
+    def get():
+        if not BreakpointIndex.instance:
+            BreakpointIndex.instance = BreakpointIndex()
+        return BreakpointIndex.instance
+
+    def on_change(self, gdb_breakpoint):
         # skip internal breakpoints
-        if gdb_breakpoint.number < 0:
-            continue
-        addresses, is_pending, what = parsed_breakpoints[gdb_breakpoint.number]
-        is_pending = getattr(gdb_breakpoint, 'pending', is_pending)
-        if not pending and is_pending:
-            continue
-        if not watchpoints and gdb_breakpoint.type != gdb.BP_BREAKPOINT:
-            continue
-        # add useful fields to the object
-        breakpoint = dict()
-        breakpoint['number'] = gdb_breakpoint.number
-        breakpoint['type'] = gdb_breakpoint.type
-        breakpoint['enabled'] = gdb_breakpoint.enabled
-        breakpoint['location'] = gdb_breakpoint.location
-        breakpoint['expression'] = gdb_breakpoint.expression
-        breakpoint['condition'] = gdb_breakpoint.condition
-        breakpoint['temporary'] = gdb_breakpoint.temporary
-        breakpoint['hit_count'] = gdb_breakpoint.hit_count
-        breakpoint['pending'] = is_pending
-        breakpoint['what'] = what
-        # add addresses and source information
-        breakpoint['addresses'] = []
-        for address, is_enabled in addresses:
-            if address:
-                sal = gdb.find_pc_line(address)
-            breakpoint['addresses'].append({
-                'address': address,
-                'enabled': is_enabled,
-                'file_name': sal.symtab.filename if address and sal.symtab else None,
-                'file_line': sal.line if address else None
-            })
-        breakpoints.append(breakpoint)
-    return breakpoints
+        if gdb_breakpoint.number > 0:
+            self.dirty[gdb_breakpoint.number] = gdb_breakpoint
+
+    def on_delete(self, gdb_breakpoint):
+        self.dirty.pop(gdb_breakpoint.number, None)
+        if self.entries.pop(gdb_breakpoint.number, None):
+            self.index()
+
+    def on_objfile(self, _):
+        self.stale = True
+
+    def refresh(self):
+        if self.stale or not self.tracking:
+            # XXX in older versions gdb.breakpoints() returns None
+            gdb_breakpoints = [gdb_breakpoint for gdb_breakpoint in gdb.breakpoints() or []
+                               if gdb_breakpoint.number > 0]
+            self.entries = {}
+            self.stale = False
+            numbers = None
+        elif self.dirty:
+            gdb_breakpoints = [gdb_breakpoint for gdb_breakpoint in self.dirty.values()
+                               if gdb_breakpoint.is_valid()]
+            numbers = sorted(gdb_breakpoint.number for gdb_breakpoint in gdb_breakpoints)
+        else:
+            return
+        self.dirty = {}
+        # parse the textual information only if the API is not enough
+        if any(gdb_breakpoint.type == gdb.BP_CATCHPOINT or
+               not hasattr(gdb_breakpoint, 'locations')
+               for gdb_breakpoint in gdb_breakpoints):
+            parsed_breakpoints = parse_breakpoints(numbers)
+        else:
+            parsed_breakpoints = {}
+        for gdb_breakpoint in gdb_breakpoints:
+            parsed = parsed_breakpoints.get(gdb_breakpoint.number, ([], False, ''))
+            if gdb_breakpoint.type == gdb.BP_BREAKPOINT and hasattr(gdb_breakpoint, 'locations'):
+                parsed = fetch_breakpoint_locations(gdb_breakpoint), False, ''
+            self.entries[gdb_breakpoint.number] = fetch_breakpoint(gdb_breakpoint, parsed)
+        self.index()
+
+    def index(self):
+        # map enabled status by address and source location, a location is
+        # enabled if it is enabled along with its root
+        self.by_address = {}
+        self.by_line = {}
+        for breakpoint in self.entries.values():
+            if breakpoint['type'] != gdb.BP_BREAKPOINT or breakpoint['pending']:
+                continue
+            addresses = breakpoint['addresses']
+            is_root_enabled = addresses[0]['enabled']
+            for address in addresses:
+                enabled = address['enabled'] and is_root_enabled
+                if address['address'] is not None:
+                    key = address['address']
+                    self.by_address[key] = self.by_address.get(key) or enabled
+                if address['file_line']:
+                    key = (address['file_name'], address['file_line'])
+                    self.by_line[key] = self.by_line.get(key) or enabled
+
+    def fetch(self, watchpoints=False, pending=False):
+        self.refresh()
+        breakpoints = []
+        for number in sorted(self.entries):
+            breakpoint = self.entries[number]
+            if not pending and breakpoint['pending']:
+                continue
+            if not watchpoints and breakpoint['type'] != gdb.BP_BREAKPOINT:
+                continue
+            breakpoints.append(breakpoint)
+        return breakpoints
+
+    def at_address(self, address):
+        # None if there is no breakpoint otherwise the enabled status
+        self.refresh()
+        return self.by_address.get(address)
+
+    def at_line(self, file_name, file_line):
+        # None if there is no breakpoint otherwise the enabled status
+        self.refresh()
+        return self.by_line.get((file_name, file_line))
+
+def fetch_breakpoints(watchpoints=False, pending=False):
+    return BreakpointIndex.get().fetch(watchpoints, pending)
+
+class StopContext():
+    '''Facts about the current stop shared by all the modules.
+
+    The dashboard creates a new instance for each render, values are fetched
+    from GDB when first requested and then reused by every module.'''
+
+    # the context of the ongoing render in each thread, if any
+    local = threading.local()
+
+    # number of stops since the dashboard has been loaded
+    stops = 0
+
+    def __init__(self):
+        self.cache = {}
+
+    def memoize(self, key, fetch):
+        try:
+            return self.cache[key]
+        except KeyError:
+            value = self.cache[key] = fetch()
+            return value
+
+    def is_stopped(self):
+        return self.memoize('is_stopped', lambda: gdb.selected_thread().is_stopped())
+
+    def frame(self):
+        return self.memoize('frame', gdb.selected_frame)
+
+    def pc(self):
+        return self.memoize('pc', lambda: self.frame().pc())
+
+    def sal(self):
+        return self.memoize('sal', lambda: self.frame().find_sal())
+
+    def function(self):
+        return self.memoize('function', lambda: self.frame().function())
+
+    def architecture(self):
+        return self.memoize('architecture', lambda: self.frame().architecture())
+
+    def pointer_size(self):
+        return self.memoize('pointer_size', lambda: gdb.parse_and_eval('$pc').type.sizeof)
+
+    def repeat_threshold(self):
+        # 0 means unlimited, i.e., repeated elements are never collapsed
+        return self.memoize('repeat_threshold', lambda: gdb.parameter('print repeats') or 0)
+
+    def print_setting(self, name):
+        # e.g., 'print object'
+        return self.memoize(name, lambda: gdb.parameter(name))
+
+    def stop_number(self):
+        return StopContext.stops
+
+    def breakpoints(self, watchpoints=False, pending=False):
+        return fetch_breakpoints(watchpoints, pending)
+
+    def breakpoint_index(self):
+        return BreakpointIndex.get()
+
+def stop_context():
+    # outside of a render every call gets a fresh context
+    return getattr(StopContext.local, 'current', None) or StopContext()
+
+class Profiler():
+    '''Rendering cost of the modules over the last stops.
+
+    While enabled, each render records for every module the time spent
+    collecting and formatting its content along with the number of GDB API
+    calls, and the number of bytes written to each output.'''
+
+    # the enabled profiler, if any
+    current = None
+
+    KINDS = ('execute', 'parse_and_eval', 'read_memory', 'unwind')
+
+    # upper bounds (in seconds) of the histogram buckets, the last is open
+    BUCKETS = (0.0001, 0.001, 0.01, 0.1)
+
+    def __init__(self, size):
+        self.samples = collections.deque(maxlen=size)
+        self.calls = None
+        self.originals = {}
+
+    @staticmethod
+    def count(kind):
+        profiler = Profiler.current
+        if profiler and profiler.calls is not None:
+            profiler.calls[kind] += 1
+
+    def start(self):
+        # wrap the GDB functions that can be intercepted, the others call
+        # count() explicitly
+        wrapped = {
+            'execute': 'execute',
+            'parse_and_eval': 'parse_and_eval',
+            'newest_frame': 'unwind',
+            'selected_frame': 'unwind'
+        }
+        for name, kind in wrapped.items():
+            function = self.originals[name] = getattr(gdb, name)
+            def wrapper(*args, function=function, kind=kind, **kwargs):
+                Profiler.count(kind)
+                return function(*args, **kwargs)
+            setattr(gdb, name, wrapper)
+        sample = {'modules': {}, 'outputs': {}}
+        self.samples.append(sample)
+        return sample
+
+    def stop(self):
+        for name, function in self.originals.items():
+            setattr(gdb, name, function)
+        self.originals = {}
+        self.calls = None
+
+    def begin(self, sample, name):
+        record = sample['modules'].setdefault(name, {'collect': 0, 'format': 0})
+        record['calls'] = self.calls = dict.fromkeys(Profiler.KINDS, 0)
+        return time.time()
+
+    def end(self, sample, name, phase, start):
+        sample['modules'][name][phase] = time.time() - start
+        self.calls = None
+
+    def summary(self):
+        # aggregate the samples per module and per output
+        modules = collections.OrderedDict()
+        outputs = collections.OrderedDict()
+        for sample in self.samples:
+            for name, record in sample['modules'].items():
+                summary = modules.setdefault(name, {'times': [], 'calls': collections.Counter()})
+                summary['times'].append(record['collect'] + record['format'])
+                summary['calls'].update(record.get('calls', {}))
+            for output, size in sample['outputs'].items():
+                outputs.setdefault(output, []).append(size)
+        return modules, outputs
+
+    @staticmethod
+    def histogram(times):
+        counts = [0] * (len(Profiler.BUCKETS) + 1)
+        for value in times:
+            counts[bisect.bisect_left(Profiler.BUCKETS, value)] += 1
+        return counts
+
+    @staticmethod
+    def percentile(values, ratio):
+        values = sorted(values)
+        return values[min(int(len(values) * ratio), len(values) - 1)]
+
+def read_memory(address, length):
+    # memory reads pass from here to be accounted by the profiler
+    Profiler.count('read_memory')
+    return gdb.selected_inferior().read_memory(address, length)
+
+def older_frame(frame):
+    # frame unwinds pass from here to be accounted by the profiler
+    Profiler.count('unwind')
+    return frame.older()
+
+def newer_frame(frame):
+    Profiler.count('unwind')
+    return frame.newer()
 
 # Dashboard --------------------------------------------------------------------
 
@@ -407,12 +1003,36 @@ class Dashboard(gdb.Command):
         # setup subcommands
         Dashboard.ConfigurationCommand(self)
         Dashboard.OutputCommand(self)
+        Dashboard.JsonCommand(self)
         Dashboard.EnabledCommand(self)
         Dashboard.LayoutCommand(self)
+        Dashboard.ProfileCommand(self)
         # setup style commands
         Dashboard.StyleCommand(self, 'dashboard', R, R.attributes())
         # main terminal
         self.output = None
+        # last frame written to each external output (incremental render)
+        self.screens = {}
+        # background formatting of the external outputs
+        self.pool = None
+        self.pool_size = 0
+        self.pending = {}
+        self.generations = {}
+        # stop waiting to be rendered before the prompt
+        self.stop_pending = False
+        # postponed render (see render_delay) and its generation
+        self.timer = None
+        self.deferred = 0
+        self.last_render = 0
+        # whether the main terminal already shows an empty output area
+        self.cleared = False
+        # data collected for the snapshot of a stop not rendered yet by module
+        # instance, (stop number, width, height, data, failure)
+        self.collected = {}
+        # structured snapshots (dashboard -json) and the last stop written
+        self.json_output = None
+        self.json_fd = None
+        self.json_stop = None
         # used to inhibit redisplays during init parsing
         self.inhibited = None
         # enabled by default
@@ -420,21 +1040,85 @@ class Dashboard(gdb.Command):
         self.enable()
 
     def on_continue(self, _):
+        # the pending stop, if any, is obsolete now
+        self.stop_pending = False
+        self.cancel_deferred()
+        # nothing has been rendered since the last time the area was cleared
+        if self.cleared:
+            return
         # try to contain the GDB messages in a specified area unless the
         # dashboard is printed to a separate file (dashboard -output ...)
         # or there are no modules to display in the main terminal
-        enabled_modules = list(filter(lambda m: not m.output and m.enabled, self.modules))
-        if self.is_running() and not self.output and len(enabled_modules) > 0:
+        if self.is_running() and self.uses_terminal():
             width, _ = Dashboard.get_term_size()
             gdb.write(Dashboard.clear_screen())
             gdb.write(divider(width, 'Output/messages', True))
             gdb.write('\n')
             gdb.flush()
+            self.cleared = True
 
     def on_stop(self, _):
-        if self.is_running():
+        StopContext.stops += 1
+        if not self.is_running():
+            return
+        # postpone the render until GDB is about to show the prompt if possible
+        if R.coalesce_stops and hasattr(gdb.events, 'before_prompt'):
+            self.stop_pending = True
+            # snapshots are written for every stop, so collect the data now and
+            # keep it for the render in case this is the last stop
+            if self.json_output:
+                self.render(clear_screen=False, write=False)
+        else:
+            self.render(clear_screen=False)
+
+    def on_before_prompt(self):
+        if not self.stop_pending:
+            return
+        self.stop_pending = False
+        if not self.is_running():
+            return
+        # postpone the render if the previous one is too recent
+        delay = R.render_delay / 1000
+        if delay and time.time() - self.last_render < delay:
+            # the frame may be selected before the postponed render
+            self.collected = {}
+            self.deferred += 1
+            generation = self.deferred
+            self.timer = threading.Timer(delay, gdb.post_event, [lambda: self.on_deferred(generation)])
+            self.timer.daemon = True
+            self.timer.start()
+        else:
             self.render(clear_screen=False)
 
+    def on_deferred(self, generation):
+        # skip if the execution has been resumed meanwhile
+        if generation != self.deferred or not self.is_running():
+            return
+        thread = gdb.selected_thread()
+        if not thread or not thread.is_stopped():
+            return
+        self.timer = None
+        # the prompt has been already shown so start from a clean line and
+        # show it again afterwards
+        terminal = self.uses_terminal()
+        if terminal:
+            gdb.write('\r' + Dashboard.clear_line())
+        self.render(clear_screen=False)
+        if terminal:
+            prompt = gdb.prompt_hook(gdb.parameter('prompt')) if gdb.prompt_hook else None
+            gdb.write(prompt or gdb.parameter('prompt'))
+            gdb.flush()
+
+    def cancel_deferred(self):
+        self.deferred += 1
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def uses_terminal(self):
+        # whether some enabled module is displayed in the main terminal
+        return not self.output and any(not m.output and m.enabled for m in self.modules)
+
     def on_exit(self, _):
         if not self.is_running():
             return
@@ -443,7 +1127,12 @@ class Dashboard(gdb.Command):
         outputs.add(self.output)
         outputs.update(module.output for module in self.modules)
         outputs.remove(None)
+        # drop any pending render
+        self.stop_pending = False
+        self.cancel_deferred()
         # reset the terminal status
+        self.wait_pending()
+        self.screens.clear()
         for output in outputs:
             try:
                 with open(output, 'w') as fs:
@@ -460,6 +1149,8 @@ class Dashboard(gdb.Command):
         gdb.events.cont.connect(self.on_continue)
         gdb.events.stop.connect(self.on_stop)
         gdb.events.exited.connect(self.on_exit)
+        if hasattr(gdb.events, 'before_prompt'):
+            gdb.events.before_prompt.connect(self.on_before_prompt)
 
     def disable(self):
         if not self.enabled:
@@ -469,6 +1160,10 @@ class Dashboard(gdb.Command):
         gdb.events.cont.disconnect(self.on_continue)
         gdb.events.stop.disconnect(self.on_stop)
         gdb.events.exited.disconnect(self.on_exit)
+        if hasattr(gdb.events, 'before_prompt'):
+            gdb.events.before_prompt.disconnect(self.on_before_prompt)
+        self.stop_pending = False
+        self.cancel_deferred()
 
     def load_modules(self, modules):
         self.modules = []
@@ -487,93 +1182,312 @@ class Dashboard(gdb.Command):
     def is_running(self):
         return self.inferior_pid() != 0
 
-    def render(self, clear_screen, style_changed=False):
-        # fetch module content and info
-        all_disabled = True
-        display_map = dict()
-        for module in self.modules:
-            # fall back to the global value
-            output = module.output or self.output
-            # add the instance or None if disabled
-            if module.enabled:
-                all_disabled = False
-                instance = module.instance
-            else:
-                instance = None
-            display_map.setdefault(output, []).append(instance)
-        # process each display info
-        for output, instances in display_map.items():
-            try:
-                buf = ''
-                # use GDB stream by default
-                fs = None
-                if output:
-                    fs = open(output, 'w')
-                    fd = fs.fileno()
-                    fs.write(Dashboard.setup_terminal())
+    def render(self, clear_screen, style_changed=False, write=True):
+        # only collect the data (and write the snapshot) if not write
+        if write:
+            self.last_render = time.time()
+            self.cleared = False
+        collected = self.collected
+        self.collected = {}
+        # share the stop information among all the modules
+        context = StopContext()
+        StopContext.local.current = context
+        # record the cost of this render if requested
+        profiler = Profiler.current
+        sample = profiler.start() if profiler else None
+        # the profiler patches some GDB functions, always restore them
+        try:
+            # fetch module content and info
+            all_disabled = True
+            display_map = dict()
+            for module in self.modules:
+                # fall back to the global value
+                output = module.output or self.output
+                # add the instance or None if disabled
+                if module.enabled:
+                    all_disabled = False
+                    instance = module.instance
                 else:
-                    fs = gdb
-                    fd = 1  # stdout
-                # get the terminal size (default main terminal if either the
-                # output is not a file)
+                    instance = None
+                display_map.setdefault(output, []).append(instance)
+            # collect the data of each display info in the GDB thread
+            jobs = []
+            records = []
+            for output, instances in display_map.items():
                 try:
-                    width, height = Dashboard.get_term_size(fd)
-                except:
-                    width, height = Dashboard.get_term_size()
-                # clear the "screen" if requested for the main terminal,
-                # auxiliary terminals are always cleared
-                if fs is not gdb or clear_screen:
-                    buf += Dashboard.clear_screen()
-                # show message if all the modules in this output are disabled
-                if not any(instances):
-                    # skip the main terminal
-                    if fs is gdb:
-                        continue
-                    # write the error message
-                    buf += divider(width, 'Warning', True)
-                    buf += '\n'
-                    if self.modules:
-                        buf += 'No module to display (see `dashboard -layout`)'
+                    # use GDB stream by default, files are opened (and truncated)
+                    # only when written since writes may happen in background
+                    fs = None
+                    if output:
+                        fd = os.open(output, os.O_WRONLY | os.O_CREAT)
                     else:
-                        buf += 'No module loaded'
-                    buf += '\n'
-                    fs.write(buf)
-                    continue
-                # process all the modules for that output
-                for n, instance in enumerate(instances, 1):
-                    # skip disabled modules
-                    if not instance:
+                        fs = gdb
+                        fd = 1  # stdout
+                    # get the terminal size (default main terminal if either the
+                    # output is not a file)
+                    try:
+                        width, height = Dashboard.get_term_size(fd)
+                    except:
+                        width, height = Dashboard.get_term_size()
+                    finally:
+                        if output:
+                            os.close(fd)
+                    # skip the main terminal if all its modules are disabled
+                    if fs is gdb and not any(instances):
                         continue
+                    # process all the modules for that output
+                    items = []
+                    for instance in instances:
+                        # skip disabled modules
+                        if not instance:
+                            items.append(None)
+                            continue
+                        if profiler:
+                            start = profiler.begin(sample, Dashboard.module_name(instance))
+                        # reuse the data already collected for the snapshot
+                        previous = collected.get(instance)
+                        if previous and not style_changed and \
+                                previous[:3] == (StopContext.stops, width, height):
+                            data, failure = previous[3:]
+                        else:
+                            try:
+                                # ask the module to collect the content
+                                data = instance.collect(width, height, style_changed)
+                                failure = None
+                            except Exception as e:
+                                # allow to continue on exceptions in modules
+                                stacktrace = traceback.format_exc().strip()
+                                data = None
+                                failure = [ansi(stacktrace, R.style_error)]
+                        if profiler:
+                            profiler.end(sample, Dashboard.module_name(instance), 'collect', start)
+                        items.append((instance, instance.label(), data, failure))
+                        records.append((instance, data, failure, width, height))
+                    jobs.append((output, fs, width, height, items))
+                except Exception as e:
+                    cause = traceback.format_exc().strip()
+                    Dashboard.err('Cannot write the dashboard\n{}'.format(cause))
+            # make sure that formatting addresses does not need GDB
+            try:
+                context.pointer_size()
+            except gdb.error:
+                pass
+            # write the structured snapshot from the same data
+            if self.json_output:
+                self.write_json(records)
+        finally:
+            # do not keep stale frames around after this stop
+            StopContext.local.current = None
+            if profiler:
+                profiler.stop()
+        if not write:
+            self.collected = {instance: (StopContext.stops, width, height, data, failure)
+                              for instance, data, failure, width, height in records}
+            return
+        # format and write the external outputs in background, if enabled,
+        # while the main terminal is handled in the GDB thread
+        pool = self.get_pool()
+        for job in jobs:
+            output, fs, _, _, _ = job
+            if fs is gdb or not pool:
+                continue
+            self.generations[output] = generation = self.generations.get(output, 0) + 1
+            previous = self.pending.get(output)
+            self.pending[output] = pool.submit(self.write_output, context, job, style_changed,
+                                               all_disabled, sample, previous, generation)
+        for job in jobs:
+            output, fs, _, _, _ = job
+            if fs is gdb or not pool:
+                self.write_output(context, job, style_changed, all_disabled, sample,
+                                  clear_screen=clear_screen)
+
+    def write_output(self, context, job, style_changed, all_disabled, sample=None,
+                     previous=None, generation=None, clear_screen=False):
+        output, fs, width, height, items = job
+        background = generation is not None
+        StopContext.local.current = context
+        try:
+            # writes to the same output must happen in order, skip this one if
+            # a newer one is already waiting
+            if previous:
+                concurrent.futures.wait([previous])
+            if background and self.generations.get(output) != generation:
+                return
+            # truncate the file only now that the previous writes are complete
+            if fs is None:
+                fs = open(output, 'w')
+            buf = ''
+            # clear the "screen" if requested for the main terminal,
+            # auxiliary terminals are handled by paint()
+            if fs is gdb and clear_screen:
+                buf += Dashboard.clear_screen()
+            # show message if all the modules in this output are disabled
+            if not any(items):
+                # write the error message
+                buf += divider(width, 'Warning', True)
+                buf += '\n'
+                if self.modules:
+                    buf += 'No module to display (see `dashboard -layout`)'
+                else:
+                    buf += 'No module loaded'
+                buf += '\n'
+                fs.write(self.paint(output, buf, width, height, style_changed or not fs.isatty()))
+                return
+            # format all the modules for that output
+            for n, item in enumerate(items, 1):
+                # skip disabled modules
+                if not item:
+                    continue
+                instance, label, data, lines = item
+                if lines is None:
+                    start = time.time()
                     try:
                         # ask the module to generate the content
-                        lines = instance.lines(width, height, style_changed)
+                        lines = instance.format(data, width, height)
                     except Exception as e:
                         # allow to continue on exceptions in modules
                         stacktrace = traceback.format_exc().strip()
                         lines = [ansi(stacktrace, R.style_error)]
-                    # create the divider if needed
-                    div = []
-                    if not R.omit_divider or len(instances) > 1 or fs is gdb:
-                        div = [divider(width, instance.label(), True, lines)]
-                    # write the data
-                    buf += '\n'.join(div + lines)
-                    # write the newline for all but last unless main terminal
-                    if n != len(instances) or fs is gdb:
-                        buf += '\n'
-                # write the final newline and the terminator only if it is the
-                # main terminal to allow the prompt to display correctly (unless
-                # there are no modules to display)
-                if fs is gdb and not all_disabled:
-                    buf += divider(width, primary=True)
+                    if sample:
+                        name = Dashboard.module_name(instance)
+                        sample['modules'][name]['format'] = time.time() - start
+                # create the divider if needed
+                div = []
+                if not R.omit_divider or len(items) > 1 or fs is gdb:
+                    div = [divider(width, label, True, lines)]
+                # write the data
+                buf += '\n'.join(div + lines)
+                # write the newline for all but last unless main terminal
+                if n != len(items) or fs is gdb:
                     buf += '\n'
-                fs.write(buf)
-            except Exception as e:
-                cause = traceback.format_exc().strip()
-                Dashboard.err('Cannot write the dashboard\n{}'.format(cause))
-            finally:
-                # don't close gdb stream
-                if fs and fs is not gdb:
-                    fs.close()
+            # write the final newline and the terminator only if it is the
+            # main terminal to allow the prompt to display correctly (unless
+            # there are no modules to display)
+            if fs is gdb and not all_disabled:
+                buf += divider(width, primary=True)
+                buf += '\n'
+            if fs is not gdb:
+                # plain files are rewritten from scratch anyway
+                buf = self.paint(output, buf, width, height, style_changed or not fs.isatty())
+            fs.write(buf)
+            if sample:
+                sample['outputs'][output or 'stdout'] = len(buf.encode('utf8'))
+        except Exception as e:
+            cause = traceback.format_exc().strip()
+            message = 'Cannot write the dashboard\n{}'.format(cause)
+            if background:
+                gdb.post_event(lambda: Dashboard.err(message))
+            else:
+                Dashboard.err(message)
+        finally:
+            StopContext.local.current = None
+            # don't close gdb stream
+            if fs and fs is not gdb:
+                fs.close()
+
+    def write_json(self, records):
+        # write only one document per stop (e.g., not for redisplays)
+        if self.json_stop == StopContext.stops:
+            return
+        modules = {}
+        for instance, data, failure, width, height in records:
+            if failure:
+                record = {'error': Dashboard.ANSI_ESCAPE.sub('', failure[0])}
+            else:
+                try:
+                    record = instance.record(data, width, height)
+                except Exception as e:
+                    record = {'error': traceback.format_exc().strip()}
+            modules[Dashboard.module_name(instance)] = record
+        document = {
+            'stop': StopContext.stops,
+            'time': time.time(),
+            'pid': self.inferior_pid(),
+            'modules': modules
+        }
+        buf = (json.dumps(document, default=str, separators=(',', ':')) + '\n').encode('utf8')
+        fd = self.open_json()
+        if fd is None:
+            return
+        try:
+            while buf:
+                buf = buf[os.write(fd, buf):]
+            self.json_stop = StopContext.stops
+        except OSError:
+            # the reader went away, try again at the next stop
+            self.close_json()
+
+    def open_json(self):
+        if self.json_fd is None:
+            try:
+                # FIFOs are opened without blocking so that the missing reader
+                # does not hang GDB, the snapshot is skipped instead
+                flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_NONBLOCK
+                self.json_fd = os.open(self.json_output, flags)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    Dashboard.err('Cannot open "{}": {}'.format(self.json_output, e.strerror))
+                return None
+            # write whole documents even if the reader is slow
+            os.set_blocking(self.json_fd, True)
+        return self.json_fd
+
+    def close_json(self):
+        if self.json_fd is not None:
+            os.close(self.json_fd)
+            self.json_fd = None
+
+    def get_pool(self):
+        # (re)create the thread pool according to the current settings
+        if self.pool_size != R.render_threads:
+            if self.pool:
+                self.pool.shutdown(wait=True)
+            self.pool = concurrent.futures.ThreadPoolExecutor(R.render_threads) if R.render_threads else None
+            self.pool_size = R.render_threads
+        return self.pool
+
+    def wait_pending(self):
+        # wait for the background writes to complete
+        concurrent.futures.wait(list(self.pending.values()))
+        self.pending.clear()
+
+    def paint(self, output, content, width, height, repaint):
+        # split the content in lines along with the number of terminal rows
+        # they occupy once wrapped
+        lines = [(line, Dashboard.count_rows(line, width)) for line in content.split('\n')]
+        fits = sum(rows for _, rows in lines) <= height
+        previous = self.screens.pop(output, None)
+        # only remember frames that fit the terminal, otherwise the screen
+        # scrolls and the row positions are unknown
+        if R.incremental_render and fits:
+            self.screens[output] = (width, height, lines)
+        # redraw the whole screen if the previous frame is not usable
+        if (not R.incremental_render or repaint or not fits or not previous or
+            previous[:2] != (width, height)):
+            return Dashboard.setup_terminal() + Dashboard.clear_screen() + content
+        # otherwise just rewrite the lines that differ from the previous frame
+        _, _, previous_lines = previous
+        buf = ''
+        row = 1
+        for n, (line, rows) in enumerate(lines):
+            previous_line, previous_rows = previous_lines[n] if n < len(previous_lines) else (None, None)
+            if line == previous_line:
+                pass
+            elif rows == previous_rows:
+                # same size, overwrite in place
+                for i in range(row, row + rows):
+                    buf += Dashboard.move_cursor(i) + Dashboard.clear_line()
+                buf += Dashboard.move_cursor(row) + line
+            else:
+                # the layout is shifted, rewrite everything from here
+                buf += Dashboard.move_cursor(row) + Dashboard.clear_below()
+                buf += '\n'.join(line for line, _ in lines[n:])
+                return buf
+            row += rows
+        # remove the leftovers of a longer previous frame
+        if len(previous_lines) > len(lines):
+            buf += Dashboard.move_cursor(row) + Dashboard.clear_below()
+        return buf
 
 # Utility methods --------------------------------------------------------------
 
@@ -598,6 +1512,11 @@ class Dashboard(gdb.Command):
         if dashboard.enabled:
             dashboard.redisplay()
 
+    @staticmethod
+    def module_name(instance):
+        # same as the module descriptor
+        return type(instance).__name__.lower()
+
     @staticmethod
     def get_term_size(fd=1):  # defaults to the main terminal
         try:
@@ -711,6 +1630,30 @@ class Dashboard(gdb.Command):
         # terminal)
         return '\x1b[H\x1b[2J' + ('\x1b[3J' if R.discard_scrollback else '')
 
+    @staticmethod
+    def move_cursor(row):
+        # ANSI: move the cursor to the first column of the row (1-based)
+        return '\x1b[{};1H'.format(row)
+
+    @staticmethod
+    def clear_line():
+        # ANSI: clear the whole line without moving the cursor
+        return '\x1b[2K'
+
+    @staticmethod
+    def clear_below():
+        # ANSI: clear from the cursor to the end of the screen
+        return '\x1b[J'
+
+    ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+
+    @staticmethod
+    def count_rows(line, width):
+        # number of terminal rows used by a line once wrapped, ANSI escape
+        # sequences do not take space (XXX wide characters are not accounted)
+        length = len(Dashboard.ANSI_ESCAPE.sub('', line))
+        return max(int(math.ceil(float(length) / width)), 1)
+
     @staticmethod
     def setup_terminal():
         # ANSI: enable alternative screen buffer and hide cursor
@@ -795,6 +1738,8 @@ class Dashboard(gdb.Command):
         elif not self.is_running():
             Dashboard.err('Is the target program running?')
         else:
+            # always redraw external outputs in full
+            self.screens.clear()
             self.redisplay()
 
     class ConfigurationCommand(gdb.Command):
@@ -891,6 +1836,8 @@ command.'''
             arg = Dashboard.parse_arg(arg)
             # reset the terminal status
             if self.obj.output:
+                self.dashboard.wait_pending()
+                self.dashboard.screens.pop(self.obj.output, None)
                 try:
                     with open(self.obj.output, 'w') as fs:
                         fs.write(Dashboard.reset_terminal())
@@ -905,6 +1852,43 @@ command.'''
             # redisplay the dashboard in the new output
             self.dashboard.redisplay()
 
+    class JsonCommand(gdb.Command):
+        '''Write a structured snapshot of the dashboard at every stop.
+
+A JSON document is appended as a single line to the specified file at every
+stop, including the stops that are not rendered (see `coalesce_stops`). It
+contains the stop number and the record of each enabled module (see the
+`record()` method of the modules) without any ANSI styling, so that the state
+of the program can be consumed by other tools. Records are built from the same
+data used for the textual output, nothing is fetched twice.
+
+A regular file is truncated first. A FIFO is opened without blocking, the
+snapshots are skipped while there is no reader.
+
+When invoked without argument the snapshots are not written anymore.'''
+
+        def __init__(self, dashboard):
+            gdb.Command.__init__(self, 'dashboard -json', gdb.COMMAND_USER, gdb.COMPLETE_FILENAME)
+            self.dashboard = dashboard
+
+        def invoke(self, arg, from_tty):
+            arg = Dashboard.parse_arg(arg)
+            self.dashboard.close_json()
+            self.dashboard.json_output = None
+            self.dashboard.json_stop = None
+            if arg == '':
+                return
+            # truncate regular files
+            if not os.path.exists(arg) or os.path.isfile(arg):
+                try:
+                    open(arg, 'w').close()
+                except IOError as e:
+                    Dashboard.err('Cannot open "{}": {}'.format(arg, e.strerror))
+                    return
+            self.dashboard.json_output = arg
+            # write the snapshot of the current stop
+            self.dashboard.redisplay()
+
     class EnabledCommand(gdb.Command):
         '''Enable or disable the dashboard.
 
@@ -1020,6 +2004,88 @@ Passing `!` as a single argument resets the dashboard original layout.'''
             all_modules = (m.name for m in self.dashboard.modules)
             return Dashboard.complete(word, all_modules)
 
+    class ProfileCommand(gdb.Command):
+        '''Profile the rendering cost of the modules.
+
+Accepts one of the following arguments:
+
+- `on` start recording the last stops (see the `profile_stops` attribute);
+- `off` stop recording and discard the samples;
+- `clear` discard the samples recorded so far;
+- `json [FILE]` dump the raw samples as JSON, optionally to a file.
+
+Without arguments show for each module the time spent in the collect and format
+phases (average, percentiles and histogram) and the average number of GDB API
+calls per stop, then the average number of bytes written to each output.'''
+
+        def __init__(self, dashboard):
+            gdb.Command.__init__(self, 'dashboard -profile', gdb.COMMAND_USER)
+            self.dashboard = dashboard
+
+        def invoke(self, arg, from_tty):
+            arg = Dashboard.parse_arg(arg)
+            command, _, path = arg.partition(' ')
+            if command == '':
+                self.show()
+            elif command == 'on':
+                if not Profiler.current:
+                    Profiler.current = Profiler(R.profile_stops)
+            elif command == 'off':
+                Profiler.current = None
+            elif command == 'clear':
+                if Profiler.current:
+                    Profiler.current.samples.clear()
+            elif command == 'json':
+                self.dump(path.strip())
+            else:
+                msg = 'Wrong argument "{}"; expecting "on", "off", "clear" or "json"'
+                Dashboard.err(msg.format(arg))
+
+        def complete(self, text, word):
+            return Dashboard.complete(word, ['on', 'off', 'clear', 'json'])
+
+        def show(self):
+            if not Profiler.current:
+                Dashboard.err('The profiler is disabled (see `dashboard -profile on`)')
+                return
+            modules, outputs = Profiler.current.summary()
+            if not modules:
+                print('No stop recorded')
+                return
+            # module costs
+            buckets = ['<{:g}'.format(bound * 1000) for bound in Profiler.BUCKETS]
+            buckets.append('>={:g}'.format(Profiler.BUCKETS[-1] * 1000))
+            name_len = max(len(name) for name in modules)
+            fmt = '{{:<{}}} {{:>6}} {{:>9}} {{:>9}} {{:>9}} {{:>9}}  {{:<30}} {{}}'.format(name_len)
+            header = fmt.format('', 'stops', 'avg ms', 'p50 ms', 'p90 ms', 'max ms',
+                                'histogram ms ({})'.format(' '.join(buckets)),
+                                ' '.join(Profiler.KINDS))
+            print(ansi(header, R.style_high))
+            for name, summary in modules.items():
+                times = summary['times']
+                stops = len(times)
+                calls = ' '.join('{}={:g}'.format(kind, round(summary['calls'][kind] / float(stops), 1))
+                                 for kind in Profiler.KINDS)
+                histogram = ' '.join(str(count) for count in Profiler.histogram(times))
+                print(fmt.format(name, stops,
+                                 '{:.2f}'.format(sum(times) / stops * 1000),
+                                 '{:.2f}'.format(Profiler.percentile(times, 0.5) * 1000),
+                                 '{:.2f}'.format(Profiler.percentile(times, 0.9) * 1000),
+                                 '{:.2f}'.format(max(times) * 1000),
+                                 histogram, calls))
+            # output sizes
+            for output, sizes in outputs.items():
+                average = sum(sizes) / len(sizes)
+                print('{} {:.0f} bytes/stop'.format(ansi(output, R.style_low), average))
+
+        def dump(self, path):
+            samples = list(Profiler.current.samples) if Profiler.current else []
+            if path:
+                with open(os.path.expanduser(path), 'w') as fs:
+                    json.dump(samples, fs)
+            else:
+                print(json.dumps(samples, indent=2))
+
     class StyleCommand(gdb.Command):
         '''Access the stylable attributes.
 
@@ -1118,9 +2184,42 @@ literals and converted to the proper type. '''
             term_width and term_height are the dimension of the terminal where
             this module will be displayed. If `style_changed` is `True` then
             some attributes have changed since the last time so the
-            implementation may want to update its status.'''
+            implementation may want to update its status.
+
+            Information about the current stop (selected frame, PC, breakpoints,
+            etc.) should be obtained with `stop_context()` so that GDB is
+            queried only once per stop for all the modules.'''
             pass
 
+        def collect(self, term_width, term_height, style_changed):
+            '''Return the data needed to produce the module content.
+
+            This is called in the GDB thread and it is the only place where the
+            GDB API can be used, the result is then passed to `format()`. By
+            default the whole content is produced here by `lines()`.'''
+            return self.lines(term_width, term_height, style_changed)
+
+        def format(self, data, term_width, term_height):
+            '''Return the list of strings which form the module content from
+            the data returned by `collect()`.
+
+            This may be called in a separate thread, even while `collect()` is
+            called for the next stop, so it must not use the GDB API and it
+            should rely on the passed data only. By default the data is already
+            the content.'''
+            return data
+
+        def record(self, data, term_width, term_height):
+            '''Return the JSON serializable record of the module content from
+            the data returned by `collect()` (see `dashboard -json`).
+
+            This is called in the GDB thread right after `collect()`, so the GDB
+            API can be used for information related to the collected data. The
+            record must not contain any ANSI styling, by default the content
+            lines are returned without the escape sequences.'''
+            lines = self.format(data, term_width, term_height)
+            return {'lines': [Dashboard.ANSI_ESCAPE.sub('', line) for line in lines]}
+
         def attributes(self):
             '''Return the dictionary of available attributes.
 
@@ -1170,11 +2269,148 @@ literals and converted to the proper type. '''
 class Source(Dashboard.Module):
     '''Show the program source code, if available.'''
 
+    class File():
+        '''Source file highlighted lazily in chunks of lines.'''
+
+        # lines per chunk
+        CHUNK = 200
+
+        # lines highlighted before a chunk to give some context to the lexer,
+        # constructs spanning more than this across the chunk boundary (e.g.,
+        # huge block comments) may be highlighted incorrectly
+        CONTEXT = 50
+
+        def __init__(self, name, source, tab_size):
+            self.beautifier = Beautifier(name, tab_size)
+            self.highlighted = self.beautifier.active
+            self.raw_lines = source.rstrip('\n').split('\n')
+            self.chunks = {}
+            self.size = sum(len(line) for line in self.raw_lines)
+            self.lock = threading.Lock()
+
+        def __len__(self):
+            return len(self.raw_lines)
+
+        def lines(self, start, end):
+            # highlight only the chunks that overlap the requested range
+            if start >= end:
+                return []
+            first = start // Source.File.CHUNK
+            last = (end - 1) // Source.File.CHUNK
+            lines = []
+            for chunk in range(first, last + 1):
+                lines.extend(self.chunk(chunk))
+            offset = first * Source.File.CHUNK
+            return lines[start - offset:end - offset]
+
+        def chunk(self, chunk):
+            with self.lock:
+                lines = self.chunks.get(chunk)
+                if lines is None:
+                    start = chunk * Source.File.CHUNK
+                    end = start + Source.File.CHUNK
+                    context = max(start - Source.File.CONTEXT, 0)
+                    raw_lines = self.raw_lines[context:end]
+                    lines = self.beautifier.process('\n'.join(raw_lines)).split('\n')
+                    # trailing empty lines are stripped by the beautifier
+                    lines += [''] * (len(raw_lines) - len(lines))
+                    lines = lines[start - context:]
+                    self.chunks[chunk] = lines
+                    self.size += sum(len(line) for line in lines)
+                return lines
+
+        def prefetch(self, line, cancelled):
+            # highlight the chunks around the given line unless cancelled
+            half = Source.File.CHUNK // 2
+            first = max(line - half, 0) // Source.File.CHUNK
+            last = min(line + half, len(self) - 1) // Source.File.CHUNK
+            for chunk in range(first, last + 1):
+                if cancelled():
+                    return
+                self.chunk(chunk)
+
+    class Cache():
+        '''Least recently used source files, shared with the background worker
+        that pre-highlights the source files of the frames on the call stack.'''
+
+        instance = None
+
+        # maximum number of pending prefetch requests
+        QUEUE_SIZE = 16
+
+        def __init__(self):
+            self.files = collections.OrderedDict()
+            self.lock = threading.Lock()
+            # settings of the last fetch, used by the prefetching
+            self.tab_size = None
+            self.limit = 0
+            # prefetch requests are dropped as soon as the inferior resumes
+            self.queue = collections.deque(maxlen=Source.Cache.QUEUE_SIZE)
+            self.condition = threading.Condition()
+            self.generation = 0
+            self.worker = None
+            gdb.events.cont.connect(self.on_continue)
+
+        @staticmethod
+        def get():
+            if not Source.Cache.instance:
+                Source.Cache.instance = Source.Cache()
+            return Source.Cache.instance
+
+        def on_continue(self, _):
+            with self.condition:
+                self.generation += 1
+                self.queue.clear()
+
+        def fetch(self, file_name, ts, tab_size, limit):
+            key = (file_name, ts, tab_size, R.ansi, R.syntax_highlighting)
+            with self.lock:
+                self.tab_size = tab_size
+                self.limit = limit
+                source_file = self.files.pop(key, None)
+            if source_file is None:
+                with io.open(file_name, errors='replace') as fs:
+                    source_file = Source.File(file_name, fs.read(), tab_size)
+            with self.lock:
+                # another thread may have loaded the same file meanwhile
+                source_file = self.files.pop(key, source_file)
+                self.files[key] = source_file
+                # evict the least recently used but the last one
+                while len(self.files) > 1 and sum(f.size for f in self.files.values()) > limit:
+                    self.files.popitem(last=False)
+            return source_file
+
+        def prefetch(self, locations):
+            # locations are (file name, timestamp, line) triples resolved in
+            # the main thread, skip if the source module never fetched a file
+            if self.tab_size is None:
+                return
+            with self.condition:
+                self.queue.extend(locations)
+                if not self.worker:
+                    self.worker = threading.Thread(target=self.work, name='dashboard-prefetch')
+                    self.worker.daemon = True
+                    self.worker.start()
+                self.condition.notify()
+
+        def work(self):
+            while True:
+                with self.condition:
+                    while not self.queue:
+                        self.condition.wait()
+                    file_name, ts, line = self.queue.popleft()
+                    generation = self.generation
+                cancelled = lambda: self.generation != generation
+                try:
+                    source_file = self.fetch(file_name, ts, self.tab_size, self.limit)
+                    source_file.prefetch(line, cancelled)
+                except IOError:
+                    # errors are reported when the file is actually displayed
+                    pass
+
     def __init__(self):
         self.file_name = None
-        self.source_lines = []
-        self.ts = None
-        self.highlighted = False
+        self.cache = Source.Cache.get()
         self.offset = 0
 
     def label(self):
@@ -1184,47 +2420,29 @@ class Source(Dashboard.Module):
         return label
 
     def lines(self, term_width, term_height, style_changed):
+        data = self.collect(term_width, term_height, style_changed)
+        return self.format(data, term_width, term_height)
+
+    def collect(self, term_width, term_height, style_changed):
         # skip if the current thread is not stopped
-        if not gdb.selected_thread().is_stopped():
-            return []
+        context = stop_context()
+        if not context.is_stopped():
+            return None
         # try to fetch the current line (skip if no line information)
-        sal = gdb.selected_frame().find_sal()
+        sal = context.sal()
         current_line = sal.line
         if current_line == 0:
             self.file_name = None
-            return []
+            return None
         # try to lookup the source file
-        candidates = [
-            sal.symtab.fullname(),
-            sal.symtab.filename,
-            # XXX GDB also uses absolute filename but it is harder to implement
-            # properly and IMHO useless
-            os.path.basename(sal.symtab.filename)]
-        for candidate in candidates:
-            file_name = candidate
-            ts = None
-            try:
-                ts = os.path.getmtime(file_name)
-                break
-            except:
-                # try another or delay error check to open()
-                continue
-        # style changed, different file name or file modified in the meanwhile
-        if style_changed or file_name != self.file_name or ts and ts > self.ts:
-            try:
-                # reload the source file if changed
-                with io.open(file_name, errors='replace') as source_file:
-                    highlighter = Beautifier(file_name, self.tab_size)
-                    self.highlighted = highlighter.active
-                    source = highlighter.process(source_file.read())
-                    self.source_lines = source.split('\n')
-                # store file name and timestamp only if success to have
-                # persistent errors
-                self.file_name = file_name
-                self.ts = ts
-            except IOError as e:
-                msg = 'Cannot display "{}"'.format(file_name)
-                return [ansi(msg, R.style_error)]
+        file_name, ts = Source.locate(sal.symtab)
+        # fetch the file from the cache, which also handles style changes and
+        # files modified in the meanwhile
+        try:
+            source_file = self.cache.fetch(file_name, ts, self.tab_size, self.cache_size * 2 ** 20)
+            self.file_name = file_name
+        except IOError as e:
+            return {'error': 'Cannot display "{}"'.format(file_name)}
         # compute the line range
         height = self.height or (term_height - 1)
         start = current_line - 1 - int(height / 2) + self.offset
@@ -1236,22 +2454,49 @@ class Source(Dashboard.Module):
             start = 0
         # extra at end
         extra_end = 0
-        if end > len(self.source_lines):
-            extra_end = min(end - len(self.source_lines), height)
-            end = len(self.source_lines)
+        if end > len(source_file):
+            extra_end = min(end - len(source_file), height)
+            end = len(source_file)
         else:
             end = max(end, 0)
+        # check for breakpoint presence, note, despite the lookup path always
+        # use the relative (sal.symtab.filename) file name to match source
+        # files with breakpoints
+        breakpoint_index = context.breakpoint_index()
+        markers = [breakpoint_index.at_line(sal.symtab.filename, number)
+                   for number in range(start + 1, end + 1)]
+        return {
+            'file_name': file_name,
+            'source_file': source_file,
+            'markers': markers,
+            'start': start,
+            'end': end,
+            'current_line': current_line,
+            'height': height,
+            'extra_start': extra_start,
+            'extra_end': extra_end,
+            'highlight_line': self.highlight_line
+        }
+
+    def format(self, data, term_width, term_height):
+        if not data:
+            return []
+        if 'error' in data:
+            return [ansi(data['error'], R.style_error)]
         # return the source code listing
-        breakpoints = fetch_breakpoints()
         out = []
-        number_format = '{{:>{}}}'.format(len(str(end)))
-        for number, line in enumerate(self.source_lines[start:end], start + 1):
+        current_line = data['current_line']
+        source_file = data['source_file']
+        number_format = '{{:>{}}}'.format(len(str(data['end'])))
+        # highlight the displayed lines only
+        lines = zip(source_file.lines(data['start'], data['end']), data['markers'])
+        for number, (line, enabled) in enumerate(lines, data['start'] + 1):
             # properly handle UTF-8 source files
             line = to_string(line)
             if int(number) == current_line:
                 # the current line has a different style without ANSI
                 if R.ansi:
-                    if self.highlighted and not self.highlight_line:
+                    if source_file.highlighted and not data['highlight_line']:
                         line_format = '{}' + ansi(number_format, R.style_selected_1) + '  {}'
                     else:
                         line_format = '{}' + ansi(number_format + '  {}', R.style_selected_1)
@@ -1260,29 +2505,51 @@ class Source(Dashboard.Module):
                     line_format = '{}' + number_format + '> {}'
             else:
                 line_format = '{}' + ansi(number_format, R.style_low) + '  {}'
-            # check for breakpoint presence
-            enabled = None
-            for breakpoint in breakpoints:
-                addresses = breakpoint['addresses']
-                is_root_enabled = addresses[0]['enabled']
-                for address in addresses:
-                    # note, despite the lookup path always use the relative
-                    # (sal.symtab.filename) file name to match source files with
-                    # breakpoints
-                    if address['file_line'] == number and address['file_name'] == sal.symtab.filename:
-                        enabled = enabled or (address['enabled'] and is_root_enabled)
             if enabled is None:
                 breakpoint = ' '
             else:
                 breakpoint = ansi('!', R.style_critical) if enabled else ansi('-', R.style_low)
             out.append(line_format.format(breakpoint, number, line.rstrip('\n')))
         # return the output along with scroll indicators
-        if len(out) <= height:
+        if len(out) <= data['height']:
             extra = [ansi('~', R.style_low)]
-            return extra_start * extra + out + extra_end * extra
+            return data['extra_start'] * extra + out + data['extra_end'] * extra
         else:
             return out
 
+    def record(self, data, term_width, term_height):
+        if not data or 'error' in data:
+            return data
+        start = data['start']
+        markers = data['markers']
+        return {
+            'file_name': data['file_name'],
+            'current_line': data['current_line'],
+            'start_line': start + 1,
+            'lines': data['source_file'].raw_lines[start:data['end']],
+            'breakpoints': [{'line': start + n, 'enabled': enabled}
+                            for n, enabled in enumerate(markers, 1) if enabled is not None]
+        }
+
+    @staticmethod
+    def locate(symtab):
+        candidates = [
+            symtab.fullname(),
+            symtab.filename,
+            # XXX GDB also uses absolute filename but it is harder to implement
+            # properly and IMHO useless
+            os.path.basename(symtab.filename)]
+        for candidate in candidates:
+            file_name = candidate
+            ts = None
+            try:
+                ts = os.path.getmtime(file_name)
+                break
+            except:
+                # try another or delay error check to open()
+                continue
+        return file_name, ts
+
     def commands(self):
         return {
             'scroll': {
@@ -1308,6 +2575,16 @@ A value of 0 uses the whole height.''',
                 'type': int,
                 'check': check_gt_zero
             },
+            'cache-size': {
+                'doc': '''Memory (in MiB) used to keep the recently displayed files.
+
+The least recently used files are evicted first, the current file is always
+kept.''',
+                'default': 32,
+                'name': 'cache_size',
+                'type': int,
+                'check': check_ge_zero
+            },
             'path': {
                 'doc': 'Path visibility flag in the module label.',
                 'default': False,
@@ -1333,38 +2610,91 @@ class Assembly(Dashboard.Module):
 
 The instructions constituting the current statement are marked, if available.'''
 
+    class Cache():
+        '''Least recently used disassembled ranges kept valid by GDB events.'''
+
+        # maximum number of cached ranges
+        SIZE = 16
+
+        def __init__(self):
+            self.entries = collections.OrderedDict()  # key to (low, high, asm)
+            gdb.events.new_objfile.connect(self.on_objfile)
+            if hasattr(gdb.events, 'clear_objfiles'):
+                gdb.events.clear_objfiles.connect(self.on_objfile)
+            if hasattr(gdb.events, 'memory_changed'):
+                gdb.events.memory_changed.connect(self.on_memory)
+            if hasattr(gdb.events, 'breakpoint_created'):
+                gdb.events.breakpoint_created.connect(self.on_breakpoint)
+
+        def on_objfile(self, _):
+            self.entries.clear()
+
+        def on_memory(self, event):
+            self.invalidate(event.address, event.address + event.length)
+
+        def on_breakpoint(self, gdb_breakpoint):
+            locations = getattr(gdb_breakpoint, 'locations', None)
+            if locations is None:
+                # no way to know the addresses
+                self.entries.clear()
+                return
+            for location in locations:
+                self.invalidate(location.address, location.address + 1)
+
+        def invalidate(self, low, high):
+            for key, (entry_low, entry_high, _) in list(self.entries.items()):
+                if entry_low < high and low < entry_high:
+                    del self.entries[key]
+
+        def get(self, key):
+            entry = self.entries.pop(key, None)
+            if entry:
+                self.entries[key] = entry
+                return entry[2]
+
+        def put(self, key, asm):
+            if asm:
+                low = asm[0]['addr']
+                high = asm[-1]['addr'] + asm[-1]['length']
+            else:
+                low = high = key[1]
+            self.entries[key] = (low, high, asm)
+            while len(self.entries) > Assembly.Cache.SIZE:
+                self.entries.popitem(last=False)
+
     def __init__(self):
         self.offset = 0
-        self.cache_key = None
-        self.cache_asm = None
+        self.cache = Assembly.Cache()
 
     def label(self):
         return 'Assembly'
 
     def lines(self, term_width, term_height, style_changed):
+        data = self.collect(term_width, term_height, style_changed)
+        return self.format(data, term_width, term_height)
+
+    def collect(self, term_width, term_height, style_changed):
         # skip if the current thread is not stopped
-        if not gdb.selected_thread().is_stopped():
-            return []
-        # flush the cache if the style is changed
-        if style_changed:
-            self.cache_key = None
-        # prepare the highlighter
+        context = stop_context()
+        if not context.is_stopped():
+            return None
+        # fetch the highlighter flavor
         try:
             flavor = gdb.parameter('disassembly-flavor')
         except:
             flavor = 'att'  # not always defined (see #36)
-        highlighter = Beautifier(flavor, tab_size=None)
         # fetch the assembly code
         line_info = None
-        frame = gdb.selected_frame()  # PC is here
+        pc = context.pc()
+        function = context.function()
         height = self.height or (term_height - 1)
         try:
             # disassemble the current block
             asm_start, asm_end = self.fetch_function_boundaries()
-            asm = self.fetch_asm(asm_start, asm_end, False, highlighter)
+            asm = self.fetch_asm(asm_start, asm_end, False)
             # find the location of the PC
             pc_index = next(index for index, instr in enumerate(asm)
-                            if instr['addr'] == frame.pc())
+                            if instr['addr'] == pc)
             # compute the instruction range
             start = pc_index - int(height / 2) + self.offset
             end = start + height
@@ -1384,7 +2714,7 @@ The instructions constituting the current statement are marked, if available.'''
             asm = asm[start:end]
             # if there are line information then use it, it may be that
             # line_info is not None but line_info.last is None
-            line_info = gdb.find_pc_line(frame.pc())
+            line_info = gdb.find_pc_line(pc)
             line_info = line_info if line_info.last else None
         except (gdb.error, RuntimeError, StopIteration):
             # if it is not possible (stripped binary or the PC is not present in
@@ -1394,42 +2724,99 @@ The instructions constituting the current statement are marked, if available.'''
                 extra_end = 0
                 # allow to scroll down nevertheless
                 clamped_offset = min(self.offset, 0)
-                asm = self.fetch_asm(frame.pc(), height - clamped_offset, True, highlighter)
+                asm = self.fetch_asm(pc, height - clamped_offset, True)
                 asm = asm[-clamped_offset:]
             except gdb.error as e:
-                msg = '{}'.format(e)
-                return [ansi(msg, R.style_error)]
+                return {'error': '{}'.format(e)}
         # fetch function start if available (e.g., not with @plt)
         func_start = None
-        if self.show_function and frame.function():
-            func_start = to_unsigned(frame.function().value())
-        # compute the maximum offset size
-        if asm and func_start:
-            max_offset = max(len(str(abs(asm[0]['addr'] - func_start))),
-                             len(str(abs(asm[-1]['addr'] - func_start))))
-        # return the machine code
-        breakpoints = fetch_breakpoints()
-        max_length = max(instr['length'] for instr in asm) if asm else 0
-        inferior = gdb.selected_inferior()
-        out = []
+        if self.show_function and function:
+            func_start = to_unsigned(function.value())
+        # fetch the opcodes of the displayed instructions with a single read
+        # when they are contiguous (i.e., not spanning discontinuous blocks)
+        block = None
+        if self.show_opcodes and asm:
+            low = asm[0]['addr']
+            high = asm[-1]['addr'] + asm[-1]['length']
+            if high - low == sum(instr['length'] for instr in asm):
+                block = memoryview(bytes(read_memory(low, high - low)))
+        # fetch opcodes and breakpoints for the displayed instructions
+        breakpoint_index = context.breakpoint_index()
+        instructions = []
+        for instr in asm:
+            addr = instr['addr']
+            opcodes = None
+            if block is not None:
+                opcodes = block[addr - low:addr - low + instr['length']]
+            elif self.show_opcodes:
+                opcodes = bytes(read_memory(addr, instr['length']))
+            instructions.append({
+                'addr': addr,
+                'addr_str': format_address(addr),
+                'asm': instr['asm'],
+                # shared with the cache to keep the highlighted text
+                'cached': instr,
+                'opcodes': opcodes,
+                'breakpoint': breakpoint_index.at_address(addr)
+            })
+        return {
+            'instructions': instructions,
+            'pc': pc,
+            'line_range': (line_info.pc, line_info.last) if line_info else None,
+            'function': str(function) if function else None,
+            'func_start': func_start,
+            'flavor': flavor,
+            'height': height,
+            'extra_start': extra_start,
+            'extra_end': extra_end,
+            'show_opcodes': self.show_opcodes,
+            'show_function': self.show_function,
+            'highlight_line': self.highlight_line
+        }
+
+    def format(self, data, term_width, term_height):
+        if not data:
+            return []
+        if 'error' in data:
+            return [ansi(data['error'], R.style_error)]
+        # prepare the highlighter
+        highlighter = Beautifier(data['flavor'], tab_size=None)
+        style = (data['flavor'], R.ansi, R.syntax_highlighting)
+        asm = data['instructions']
+        pc = data['pc']
+        line_range = data['line_range']
+        func_start = data['func_start']
+        # compute the maximum offset size
+        if asm and func_start:
+            max_offset = max(len(str(abs(asm[0]['addr'] - func_start))),
+                             len(str(abs(asm[-1]['addr'] - func_start))))
+        # return the machine code
+        max_length = max(len(instr['opcodes']) for instr in asm) if data['show_opcodes'] and asm else 0
+        out = []
         for index, instr in enumerate(asm):
             addr = instr['addr']
-            length = instr['length']
-            text = instr['asm']
-            addr_str = format_address(addr)
-            if self.show_opcodes:
-                # fetch and format opcode
-                region = inferior.read_memory(addr, length)
-                opcodes = (' '.join('{:02x}'.format(ord(byte)) for byte in region))
+            # highlight again only if the style is changed
+            cached = instr['cached']
+            highlighted = cached.get('highlighted')
+            if highlighted and highlighted[0] == style:
+                text = highlighted[1]
+            else:
+                text = highlighter.process(instr['asm'])
+                cached['highlighted'] = (style, text)
+            addr_str = instr['addr_str']
+            if data['show_opcodes']:
+                # format opcode
+                region = instr['opcodes']
+                opcodes = format_bytes(region)
                 opcodes += (max_length - len(region)) * 3 * ' ' + '  '
             else:
                 opcodes = ''
             # compute the offset if available
-            if self.show_function:
+            if data['show_function']:
                 if func_start:
                     offset = '{:+d}'.format(addr - func_start)
                     offset = offset.ljust(max_offset + 1)  # sign
-                    func_info = '{}{}'.format(frame.function(), offset)
+                    func_info = '{}{}'.format(data['function'], offset)
                 else:
                     func_info = '?'
             else:
@@ -1437,47 +2824,60 @@ The instructions constituting the current statement are marked, if available.'''
             format_string = '{}{}{}{}{}{}'
             indicator = '  '
             text = ' ' + text
-            if addr == frame.pc():
+            if addr == pc:
                 if not R.ansi:
                     indicator = '> '
                 addr_str = ansi(addr_str, R.style_selected_1)
                 indicator = ansi(indicator, R.style_selected_1)
                 opcodes = ansi(opcodes, R.style_selected_1)
                 func_info = ansi(func_info, R.style_selected_1)
-                if not highlighter.active or self.highlight_line:
+                if not highlighter.active or data['highlight_line']:
                     text = ansi(text, R.style_selected_1)
-            elif line_info and line_info.pc <= addr < line_info.last:
+            elif line_range and line_range[0] <= addr < line_range[1]:
                 if not R.ansi:
                     indicator = ': '
                 addr_str = ansi(addr_str, R.style_selected_2)
                 indicator = ansi(indicator, R.style_selected_2)
                 opcodes = ansi(opcodes, R.style_selected_2)
                 func_info = ansi(func_info, R.style_selected_2)
-                if not highlighter.active or self.highlight_line:
+                if not highlighter.active or data['highlight_line']:
                     text = ansi(text, R.style_selected_2)
             else:
                 addr_str = ansi(addr_str, R.style_low)
                 func_info = ansi(func_info, R.style_low)
             # check for breakpoint presence
-            enabled = None
-            for breakpoint in breakpoints:
-                addresses = breakpoint['addresses']
-                is_root_enabled = addresses[0]['enabled']
-                for address in addresses:
-                    if address['address'] == addr:
-                        enabled = enabled or (address['enabled'] and is_root_enabled)
+            enabled = instr['breakpoint']
             if enabled is None:
                 breakpoint = ' '
             else:
                 breakpoint = ansi('!', R.style_critical) if enabled else ansi('-', R.style_low)
             out.append(format_string.format(breakpoint, addr_str, indicator, opcodes, func_info, text))
         # return the output along with scroll indicators
-        if len(out) <= height:
+        if len(out) <= data['height']:
             extra = [ansi('~', R.style_low)]
-            return extra_start * extra + out + extra_end * extra
+            return data['extra_start'] * extra + out + data['extra_end'] * extra
         else:
             return out
 
+    def record(self, data, term_width, term_height):
+        if not data or 'error' in data:
+            return data
+        instructions = []
+        for instr in data['instructions']:
+            opcodes = instr['opcodes']
+            instructions.append({
+                'address': instr['addr'],
+                'asm': instr['asm'],
+                'opcodes': format_bytes(opcodes, '') if opcodes is not None else None,
+                'breakpoint': instr['breakpoint'],
+                'current': instr['addr'] == data['pc']
+            })
+        return {
+            'pc': data['pc'],
+            'function': data['function'],
+            'instructions': instructions
+        }
+
     def commands(self):
         return {
             'scroll': {
@@ -1523,7 +2923,9 @@ A value of 0 uses the whole height.''',
             self.offset = 0
 
     def fetch_function_boundaries(self):
-        frame = gdb.selected_frame()
+        context = stop_context()
+        frame = context.frame()
+        function = context.function()
         # parse the output of the disassemble GDB command to find the function
         # boundaries, this should handle cases in which a function spans
         # multiple discontinuous blocks
@@ -1531,43 +2933,65 @@ A value of 0 uses the whole height.''',
         for block_start, block_end in re.findall(r'Address range 0x([0-9a-f]+) to 0x([0-9a-f]+):', disassemble):
             block_start = int(block_start, 16)
             block_end = int(block_end, 16)
-            if block_start <= frame.pc() < block_end:
+            if block_start <= context.pc() < block_end:
                 return block_start, block_end - 1 # need to be inclusive
         # if function information is available then try to obtain the
         # boundaries by looking at the superblocks
         block = frame.block()
-        if frame.function():
-            while block and (not block.function or block.function.name != frame.function().name):
+        if function:
+            while block and (not block.function or block.function.name != function.name):
                 block = block.superblock
             block = block or frame.block()
         return block.start, block.end - 1
 
-    def fetch_asm(self, start, end_or_count, relative, highlighter):
-        # fetch asm from cache or disassemble
-        if self.cache_key == (start, end_or_count):
-            asm = self.cache_asm
-        else:
+    def fetch_asm(self, start, end_or_count, relative):
+        # fetch asm from cache or disassemble (the highlighting happens while
+        # formatting, only for the displayed instructions)
+        architecture = stop_context().architecture()
+        key = (architecture.name(), start, end_or_count, relative)
+        asm = self.cache.get(key)
+        if asm is None:
             kwargs = {
                 'start_pc': start,
                 'count' if relative else 'end_pc': end_or_count
             }
-            asm = gdb.selected_frame().architecture().disassemble(**kwargs)
-            self.cache_key = (start, end_or_count)
-            self.cache_asm = asm
-            # syntax highlight the cached entry
-            for instr in asm:
-                instr['asm'] = highlighter.process(instr['asm'])
+            asm = architecture.disassemble(**kwargs)
+            self.cache.put(key, asm)
         return asm
 
 class Variables(Dashboard.Module):
-    '''Show arguments and locals of the selected frame.'''
+    '''Show arguments and locals of the selected frame.
+
+The variables changed since the previous stop are highlighted.'''
+
+    # maximum number of frames whose variables are remembered
+    FRAMES = 16
+
+    # type name to whether its values only depend on their bytes
+    PLAIN_TYPES = {}
+
+    # maximum size of the values whose bytes are compared across stops, bigger
+    # values are just formatted (within the maximum value length)
+    MAX_RAW_BYTES = 4096
+
+    def __init__(self):
+        self.frames = collections.OrderedDict()
 
     def label(self):
         return 'Variables'
 
     def lines(self, term_width, term_height, style_changed):
+        if style_changed:
+            self.frames.clear()
+        frame = stop_context().frame()
+        # keep the formatted variables of the recently selected frames
+        key = Variables.frame_key(frame)
+        cache = self.frames.pop(key, {})
+        self.frames[key] = cache
+        while len(self.frames) > Variables.FRAMES:
+            self.frames.popitem(last=False)
         return Variables.format_frame(
-            gdb.selected_frame(), self.show_arguments, self.show_locals, self.compact, self.align, self.sort)
+            frame, self.show_arguments, self.show_locals, self.compact, self.align, self.sort, cache)
 
     def attributes(self):
         return {
@@ -1601,7 +3025,7 @@ class Variables(Dashboard.Module):
         }
 
     @staticmethod
-    def format_frame(frame, show_arguments, show_locals, compact, align, sort):
+    def format_frame(frame, show_arguments, show_locals, compact, align, sort, cache=None):
         out = []
         # fetch frame arguments and locals
         decorator = gdb.FrameDecorator.FrameDecorator(frame)
@@ -1610,7 +3034,7 @@ class Variables(Dashboard.Module):
             def prefix(line):
                 return Stack.format_line('arg', line)
             frame_args = decorator.frame_args()
-            args_lines = Variables.fetch(frame, frame_args, compact, align, sort)
+            args_lines = Variables.fetch(frame, frame_args, compact, align, sort, cache)
             if args_lines:
                 if compact:
                     args_line = separator.join(args_lines)
@@ -1622,7 +3046,7 @@ class Variables(Dashboard.Module):
             def prefix(line):
                 return Stack.format_line('loc', line)
             frame_locals = decorator.frame_locals()
-            locals_lines = Variables.fetch(frame, frame_locals, compact, align, sort)
+            locals_lines = Variables.fetch(frame, frame_locals, compact, align, sort, cache)
             if locals_lines:
                 if compact:
                     locals_line = separator.join(locals_lines)
@@ -1633,43 +3057,168 @@ class Variables(Dashboard.Module):
         return out
 
     @staticmethod
-    def fetch(frame, data, compact, align, sort):
+    def fetch(frame, data, compact, align, sort, cache=None):
         lines = []
         name_width = 0
         if align and not compact:
             name_width = max(len(str(elem.sym)) for elem in data) if data else 0
         for elem in data or []:
-            name = ansi(elem.sym, R.style_high) + ' ' * (name_width - len(str(elem.sym)))
+            value = elem.sym.value(frame)
+            if cache is None:
+                value, changed = format_value(value, compact), False
+            else:
+                key = (str(elem.sym), getattr(elem.sym, 'line', None))
+                value, changed = Variables.format_cached(cache, key, value, compact)
+            style = R.style_selected_1 if changed else R.style_high
+            name = ansi(elem.sym, style) + ' ' * (name_width - len(str(elem.sym)))
             equal = ansi('=', R.style_high)
-            value = format_value(elem.sym.value(frame), compact)
-            lines.append('{} {} {}'.format(name, equal, value))
+            lines.append((str(elem.sym), '{} {} {}'.format(name, equal, value)))
         if sort:
-            lines.sort()
-        return lines
+            lines.sort(key=lambda line: line[0])
+        return [line for _, line in lines]
+
+    @staticmethod
+    def format_cached(cache, key, value, compact):
+        # return the formatted value and whether it changed since the previous
+        # stop, the formatting is skipped if the raw bytes are unchanged
+        stop_number = stop_context().stop_number()
+        raw = Variables.fetch_raw_bytes(value)
+        previous = cache.get(key)
+        if previous and raw is not None and previous[0] == raw and previous[1] == compact:
+            formatted = previous[2]
+        else:
+            formatted = format_value(value, compact)
+        changed_at = previous[3] if previous else None
+        if previous and previous[1] == compact and previous[2] != formatted:
+            changed_at = stop_number
+        cache[key] = (raw, compact, formatted, changed_at)
+        return formatted, changed_at == stop_number
+
+    @staticmethod
+    def fetch_raw_bytes(value):
+        # only values whose representation depends on their bytes alone (no
+        # pointers nor pretty printers) are considered
+        try:
+            if value.type.sizeof > Variables.MAX_RAW_BYTES:
+                return None
+            if not Variables.is_plain(value.type) or gdb.default_visualizer(value):
+                return None
+            # Value.bytes is a recent addition
+            try:
+                return bytes(value.bytes)
+            except AttributeError:
+                if value.address is None:
+                    return None
+                return bytes(read_memory(int(value.address), value.type.sizeof))
+        except gdb.error:
+            return None
+
+    @staticmethod
+    def is_plain(value_type):
+        name = str(value_type)
+        plain = Variables.PLAIN_TYPES.get(name)
+        if plain is None:
+            value_type = value_type.strip_typedefs()
+            code = value_type.code
+            if code in (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_FLT, gdb.TYPE_CODE_BOOL,
+                        gdb.TYPE_CODE_CHAR, gdb.TYPE_CODE_ENUM):
+                plain = True
+            elif code == gdb.TYPE_CODE_ARRAY:
+                plain = Variables.is_plain(value_type.target())
+            elif code in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION):
+                plain = all(Variables.is_plain(field.type) for field in value_type.fields()
+                            if hasattr(field, 'bitpos'))
+            else:
+                plain = False
+            # anonymous types share the same name (e.g., "struct {...}")
+            if '{...}' not in name:
+                Variables.PLAIN_TYPES[name] = plain
+        return plain
+
+    @staticmethod
+    def frame_key(frame):
+        # frames are identified by function and stack pointer
+        try:
+            stack_pointer = int(frame.read_register('sp'))
+        except (gdb.error, ValueError):
+            stack_pointer = None
+        return (str(frame.function() or frame.name()), stack_pointer)
 
 class Stack(Dashboard.Module):
     '''Show the current stack trace including the function name and the file location, if available.
 
 Optionally list the frame arguments and locals too.'''
 
+    def __init__(self):
+        self.frame_infos = {}
+        # displayed frames of the current stop (see dashboard -json)
+        self.displayed = []
+        self.more = False
+
     def label(self):
         return 'Stack'
 
     def lines(self, term_width, term_height, style_changed):
+        self.displayed = []
+        self.more = False
         # skip if the current thread is not stopped
-        if not gdb.selected_thread().is_stopped():
+        context = stop_context()
+        if not context.is_stopped():
             return []
-        # find the selected frame level (XXX Frame.level() is a recent addition)
-        start_level = 0
-        frame = gdb.newest_frame()
-        while frame:
-            if frame == gdb.selected_frame():
-                break
-            frame = frame.older()
-            start_level += 1
+        if style_changed:
+            self.frame_infos = {}
+        frames, start_level, more = self.fetch_frames(context)
+        # pre-highlight the source files of the displayed frames in background
+        # so that moving across the stack does not wait for them
+        Stack.prefetch_sources(frames)
+        # format the output, keeping the information of the displayed frames
+        # only for the next stop
+        lines = []
+        frame_infos = {}
+        for number, frame in enumerate(frames, start=start_level):
+            selected = frame == context.frame()
+            lines.extend(self.get_frame_lines(number, frame, selected, frame_infos))
+            self.displayed.append((number, frame, selected))
+        self.frame_infos = frame_infos
+        self.more = more
+        # add the placeholder
+        if more:
+            lines.append('[{}]'.format(ansi('+', R.style_selected_2)))
+        return lines
+
+    def record(self, data, term_width, term_height):
+        # the frames are still valid as this is called during the same stop
+        frames = []
+        for number, frame, selected in self.displayed:
+            sal = frame.find_sal()
+            frames.append({
+                'level': number,
+                'function': frame.name(),
+                'pc': frame.pc(),
+                'file_name': sal.symtab.filename if sal.symtab else None,
+                'line': sal.line or None,
+                'selected': selected
+            })
+        return {'frames': frames, 'more': self.more}
+
+    def fetch_frames(self, context):
+        # return the displayed frames around the selected one, the level of the
+        # first and whether there are more frames
+        # find the selected frame level without unwinding the whole stack if
+        # possible (XXX Frame.level() is a recent addition)
+        if hasattr(context.frame(), 'level'):
+            start_level = context.frame().level()
+        else:
+            start_level = 0
+            frame = gdb.newest_frame()
+            while frame:
+                if frame == context.frame():
+                    break
+                frame = older_frame(frame)
+                start_level += 1
         # gather the frames
         more = False
-        frames = [gdb.selected_frame()]
+        frames = [context.frame()]
         going_down = True
         while True:
             # stack frames limit reached
@@ -1678,38 +3227,30 @@ Optionally list the frame arguments and locals too.'''
                 break
             # zigzag the frames starting from the selected one
             if going_down:
-                frame = frames[-1].older()
+                frame = older_frame(frames[-1])
                 if frame:
                     frames.append(frame)
                 else:
-                    frame = frames[0].newer()
+                    frame = newer_frame(frames[0])
                     if frame:
                         frames.insert(0, frame)
                         start_level -= 1
                     else:
                         break
             else:
-                frame = frames[0].newer()
+                frame = newer_frame(frames[0])
                 if frame:
                     frames.insert(0, frame)
                     start_level -= 1
                 else:
-                    frame = frames[-1].older()
+                    frame = older_frame(frames[-1])
                     if frame:
                         frames.append(frame)
                     else:
                         break
             # switch direction
             going_down = not going_down
-        # format the output
-        lines = []
-        for number, frame in enumerate(frames, start=start_level):
-            selected = frame == gdb.selected_frame()
-            lines.extend(self.get_frame_lines(number, frame, selected))
-        # add the placeholder
-        if more:
-            lines.append('[{}]'.format(ansi('+', R.style_selected_2)))
-        return lines
+        return frames, start_level, more
 
     def attributes(self):
         return {
@@ -1748,11 +3289,14 @@ Optionally list the frame arguments and locals too.'''
             }
         }
 
-    def get_frame_lines(self, number, frame, selected=False):
+    def get_frame_lines(self, number, frame, selected=False, frame_infos=None):
         # fetch frame info
         style = R.style_selected_1 if selected else R.style_selected_2
         frame_id = ansi(str(number), style)
-        info = Stack.get_pc_line(frame, style)
+        if frame_infos is None:
+            info = Stack.get_pc_line(frame, style)
+        else:
+            info = self.get_cached_pc_line(frame, style, frame_infos)
         frame_lines = []
         frame_lines.append('[{}] {}'.format(frame_id, info))
         # add frame arguments and locals
@@ -1761,6 +3305,34 @@ Optionally list the frame arguments and locals too.'''
         frame_lines.extend(variables)
         return frame_lines
 
+    def get_cached_pc_line(self, frame, style, frame_infos):
+        # a frame is identified by its PC and SP so the information of frames
+        # unchanged since the previous stop (e.g., the older ones) is reused,
+        # inline frames share both with their callers thus are not cached
+        if frame.type() == gdb.INLINE_FRAME:
+            return Stack.get_pc_line(frame, style)
+        # the SP may be unavailable (e.g., core files or corrupted stacks)
+        try:
+            stack_pointer = int(frame.read_register('sp'))
+        except (gdb.error, ValueError):
+            return Stack.get_pc_line(frame, style)
+        key = (frame.pc(), stack_pointer, style, R.ansi)
+        info = self.frame_infos.get(key)
+        if info is None:
+            info = Stack.get_pc_line(frame, style)
+        frame_infos[key] = info
+        return info
+
+    @staticmethod
+    def prefetch_sources(frames):
+        locations = []
+        for frame in frames:
+            sal = frame.find_sal()
+            if sal and sal.symtab and sal.line:
+                file_name, ts = Source.locate(sal.symtab)
+                locations.append((file_name, ts, sal.line))
+        Source.Cache.get().prefetch(locations)
+
     @staticmethod
     def format_line(prefix, line):
         prefix = ansi(prefix, R.style_low)
@@ -1768,15 +3340,17 @@ Optionally list the frame arguments and locals too.'''
 
     @staticmethod
     def get_pc_line(frame, style):
-        frame_pc = ansi(format_address(frame.pc()), style)
+        pc = frame.pc()
+        function = frame.function()
+        frame_pc = ansi(format_address(pc), style)
         info = 'from {}'.format(frame_pc)
         # if a frame function symbol is available then use it to fetch the
         # current function name and address, otherwise fall back relying on the
         # frame name
-        if frame.function():
-            name = ansi(frame.function(), style)
-            func_start = to_unsigned(frame.function().value())
-            offset = ansi(str(frame.pc() - func_start), style)
+        if function:
+            name = ansi(function, style)
+            func_start = to_unsigned(function.value())
+            offset = ansi(str(pc - func_start), style)
             info += ' in {}+{}'.format(name, offset)
         elif frame.name():
             name = ansi(frame.name(), style)
@@ -1791,22 +3365,81 @@ Optionally list the frame arguments and locals too.'''
 class History():
     '''List the last entries of the value history.'''
 
+    def __init__(self):
+        # formatted entries by absolute history index
+        self.entries = {}
+        self.settings = None
+
     def label(self):
         return 'History'
 
     def lines(self, term_width, term_height, style_changed):
         out = []
-        # fetch last entries
-        for i in range(-self.limit + 1, 1):
+        count = History.history_count()
+        # the formatting depends on the styles and on the value settings
+        settings = (R.ansi, R.compact_values, R.max_value_length, R.dereference)
+        if style_changed or settings != self.settings:
+            self.entries = {}
+            self.settings = settings
+        # the history has been cleared (e.g., after reloading the symbols)
+        if self.entries and max(self.entries) > count:
+            self.entries = {}
+        entries = {}
+        # fetch last entries formatting only the new ones
+        for index in range(max(count - self.limit + 1, 1), count + 1):
+            value = self.entries.get(index)
+            if value is None:
+                try:
+                    value, cacheable = History.format_entry(gdb.history(index))
+                except gdb.error:
+                    continue
+                if cacheable:
+                    entries[index] = value
+            else:
+                entries[index] = value
+            out.append(History.format_line(count - index, value))
+        self.entries = entries
+        return out
+
+    @staticmethod
+    def format_line(offset, value):
+        value_id = ansi('$${}', R.style_high).format(offset)
+        equal = ansi('=', R.style_low)
+        return '{} {} {}'.format(value_id, equal, value)
+
+    @staticmethod
+    def format_entry(value):
+        # return the formatted value and whether it can be reused in the next
+        # stops, history values are immutable unless they are lazy or their
+        # representation follows pointers (e.g., strings, also as members) or
+        # depends on pretty printers
+        formatted = format_value(value)
+        cacheable = (not value.is_lazy and Variables.is_plain(value.type) and
+                     not gdb.default_visualizer(value))
+        return formatted, cacheable
+
+    @staticmethod
+    def history_count():
+        # XXX gdb.history_count() is a recent addition, otherwise look for the
+        # last valid absolute index
+        if hasattr(gdb, 'history_count'):
+            return gdb.history_count()
+        def exists(index):
             try:
-                value = format_value(gdb.history(i))
-                value_id = ansi('$${}', R.style_high).format(abs(i))
-                equal = ansi('=', R.style_low)
-                line = '{} {} {}'.format(value_id, equal, value)
-                out.append(line)
+                gdb.history(index)
+                return True
             except gdb.error:
-                continue
-        return out
+                return False
+        low, high = 0, 1
+        while exists(high):
+            low, high = high, high * 2
+        while high - low > 1:
+            middle = (low + high) // 2
+            if exists(middle):
+                low = middle
+            else:
+                high = middle
+        return low
 
     def attributes(self):
         return {
@@ -1823,58 +3456,154 @@ class Memory():
 
     DEFAULT_LENGTH = 16
 
+    # translation table that maps non-zero bytes to 1
+    NONZERO = bytes(bytearray([0] + [1] * 255))
+
     class Region():
+        # size of the chunks in which the snapshots are stored
+        CHUNK = 256
+
         def __init__(self, expression, length, module):
             self.expression = expression
             self.length = length
             self.module = module
-            self.original = None
-            self.latest = None
+            self.offset = 0
+            self.original = {}
+            self.latest = {}
+            # (stop number, [(offset, bytes)]) runs written in each stop
+            self.timeline = collections.deque()
 
         def reset(self):
-            self.original = None
-            self.latest = None
-
-        def format(self, per_line):
-            # fetch the memory content
-            try:
-                address = Memory.parse_as_address(self.expression)
-                inferior = gdb.selected_inferior()
-                memory = inferior.read_memory(address, self.length)
+            self.original = {}
+            self.latest = {}
+            self.timeline.clear()
+
+        def error(self, e):
+            msg = 'Cannot access {} bytes starting at {}: {}'
+            return {'error': msg.format(self.length, self.expression, e)}
+
+        def window(self, per_line, height):
+            # return the (start, end) offsets of the visible bytes and the
+            # (low, high) offsets of the chunks containing them
+            rows = max(int(math.ceil(float(self.length) / per_line)), 1)
+            visible = min(height or rows, rows)
+            self.offset = max(min(self.offset, rows - visible), 0)
+            start = self.offset * per_line
+            end = min(start + visible * per_line, self.length)
+            chunk = Memory.Region.CHUNK
+            low = start // chunk * chunk
+            high = min(-(-end // chunk) * chunk, self.length)
+            return start, end, low, high
+
+        def fetch(self, address, window, memory):
+            # compare the visible chunks against the snapshots, which are stored
+            # as hash and compressed content so that only the chunks ever
+            # displayed are kept and unchanged ones are detected quickly,
+            # changed chunks are returned decompressed, None otherwise
+            start, end, low, high = window
+            chunk = Memory.Region.CHUNK
+            latest = {}
+            changed_latest = []
+            changed_original = []
+            runs = []
+            for offset in range(0, high - low, chunk):
+                index = (low + offset) // chunk
+                content = memory[offset:offset + chunk]
+                digest = hash(content)
+                # the latest snapshot only keeps the visible chunks
+                previous = self.latest.get(index)
+                if previous and previous[0] == digest:
+                    latest[index] = previous
+                else:
+                    latest[index] = (digest, zlib.compress(content))
+                changed_latest.append(Memory.Region.decompress(previous, digest))
                 # set the original memory snapshot if needed
-                if not self.original:
-                    self.original = memory
-            except gdb.error as e:
-                msg = 'Cannot access {} bytes starting at {}: {}'
-                msg = msg.format(self.length, self.expression, e)
-                return [ansi(msg, R.style_error)]
+                original = self.original.setdefault(index, latest[index])
+                changed_original.append(Memory.Region.decompress(original, digest))
+                # keep track of the written runs of bytes
+                if changed_latest[-1] is not None:
+                    mask = Memory.Region.changes(content, changed_latest[-1])
+                    mask = mask.to_bytes(len(content), 'big')
+                    for run in re.finditer(b'\x01+', mask):
+                        run_start, run_end = run.span()
+                        runs.append((low + offset + run_start, bytes(content[run_start:run_end])))
+            self.latest = latest
+            self.record(runs)
+            return {
+                'address': address,
+                'memory': memory,
+                'start': start,
+                'end': end,
+                'low': low,
+                'latest': changed_latest,
+                'original': changed_original
+            }
+
+        def record(self, runs):
+            # only the stops that changed something are kept so that the
+            # memory used is proportional to the amount of changes
+            size = self.module.timeline
+            if self.timeline.maxlen != size:
+                self.timeline = collections.deque(self.timeline, maxlen=size)
+            if runs and size:
+                self.timeline.append((stop_context().stop_number(), runs))
+
+        def history(self, offset):
+            # return the original value, if known, and the (stop number, value)
+            # writes of the byte at the given offset, oldest first
+            original = self.original.get(offset // Memory.Region.CHUNK)
+            if original:
+                original = bytearray(zlib.decompress(original[1]))[offset % Memory.Region.CHUNK]
+            writes = []
+            for stop, runs in self.timeline:
+                for run_offset, content in runs:
+                    if run_offset <= offset < run_offset + len(content):
+                        writes.append((stop, bytearray(content)[offset - run_offset]))
+            return original, writes
+
+        @staticmethod
+        def decompress(snapshot, digest):
+            if snapshot and snapshot[0] != digest:
+                return zlib.decompress(snapshot[1])
+
+        def format(self, data, per_line):
+            if 'error' in data:
+                return [ansi(data['error'], R.style_error)]
+            start = data['start'] - data['low']
+            end = data['end'] - data['low']
+            address = data['address'] + data['start']
+            # compute the changes in bulk, each byte of the mask holds 2 if
+            # changed since the latest snapshot, 1 if changed since the
+            # original one (if cumulative) or 0 otherwise
+            masks = []
+            chunk = Memory.Region.CHUNK
+            for index, offset in enumerate(range(0, len(data['memory']), chunk)):
+                content = data['memory'][offset:offset + chunk]
+                mask = Memory.Region.changes(content, data['latest'][index]) << 1
+                if self.module.cumulative:
+                    mask |= Memory.Region.changes(content, data['original'][index])
+                masks.append(mask.to_bytes(len(content), 'big'))
+            mask = b''.join(masks)[start:end]
+            memory = data['memory'][start:end]
+            styles = (R.style_high, R.style_selected_2, R.style_selected_1, R.style_selected_1)
+            text_table = self.module.get_text_table()
             # format the memory content
             out = []
             for i in range(0, len(memory), per_line):
                 region = memory[i:i + per_line]
                 pad = per_line - len(region)
                 address_str = format_address(address + i)
-                # compute changes
+                # format the runs of bytes with the same style at once
                 hexa = []
                 text = []
-                for j in range(len(region)):
-                    rel = i + j
-                    byte = memory[rel]
-                    hexa_byte = '{:02x}'.format(ord(byte))
-                    text_byte = self.module.format_byte(byte)
-                    # differences against the latest have the highest priority
-                    if self.latest and memory[rel] != self.latest[rel]:
-                        hexa_byte = ansi(hexa_byte, R.style_selected_1)
-                        text_byte = ansi(text_byte, R.style_selected_1)
-                    # cumulative changes if enabled
-                    elif self.module.cumulative and memory[rel] != self.original[rel]:
-                        hexa_byte = ansi(hexa_byte, R.style_selected_2)
-                        text_byte = ansi(text_byte, R.style_selected_2)
-                    # format the text differently for clarity
-                    else:
-                        text_byte = ansi(text_byte, R.style_high)
-                    hexa.append(hexa_byte)
-                    text.append(text_byte)
+                for run in Memory.Region.RUNS.finditer(mask, i, i + len(region)):
+                    start, end = run.span()
+                    style = styles[mask[start]]
+                    hexa_run = format_bytes(memory[start:end])
+                    text_run = bytes(memory[start:end]).decode('latin-1').translate(text_table)
+                    # the unchanged bytes are not highlighted in hexadecimal
+                    hexa.append(ansi(hexa_run, style) if mask[start] else hexa_run)
+                    text.append(ansi(text_run, style))
                 # output the formatted line
                 hexa_placeholder = ' {}'.format(self.module.placeholder[0] * 2)
                 text_placeholder = self.module.placeholder[0]
@@ -1882,23 +3611,105 @@ class Memory():
                     ansi(address_str, R.style_low),
                     ' '.join(hexa), ansi(pad * hexa_placeholder, R.style_low),
                     ''.join(text), ansi(pad * text_placeholder, R.style_low)))
-            # update the latest memory snapshot
-            self.latest = memory
             return out
 
+        # runs of bytes with the same change mask, see format()
+        RUNS = re.compile(b'\x00+|\x01+|[\x02\x03]+')
+
+        @staticmethod
+        def changes(memory, snapshot):
+            # return an integer with a byte set to 1 for each changed byte
+            if snapshot is None:
+                return 0
+            diff = int.from_bytes(memory, 'big') ^ int.from_bytes(snapshot, 'big')
+            return int.from_bytes(diff.to_bytes(len(memory), 'big').translate(Memory.NONZERO), 'big')
+
     def __init__(self):
         self.table = {}
+        self.text_table = None
 
     def label(self):
         return 'Memory'
 
     def lines(self, term_width, term_height, style_changed):
+        data = self.collect(term_width, term_height, style_changed)
+        return self.format(data, term_width, term_height)
+
+    def collect(self, term_width, term_height, style_changed):
+        per_line = self.get_per_line(term_width)
+        # resolve the addresses of all the regions and compute the visible
+        # portion of each of them
+        regions = []
+        spans = []
+        windows = {}
+        for region in self.table.values():
+            try:
+                address = Memory.parse_as_address(region.expression)
+                window = region.window(per_line, self.height)
+                windows[region] = (address, window)
+                spans.append((address + window[2], address + window[3], region))
+                regions.append((region, None))
+            except gdb.error as e:
+                regions.append((region, region.error(e)))
+        # read the memory content with as few reads as possible and hand each
+        # region a slice of the merged buffer
+        fetched = {}
+        for low, high, members in Memory.plan_reads(spans, self.gap):
+            try:
+                memory = memoryview(bytes(read_memory(low, high - low)))
+            except gdb.error as e:
+                if len(members) == 1:
+                    fetched[members[0][2]] = members[0][2].error(e)
+                    continue
+                # the gaps may not be accessible, read the regions one by one
+                # to report the errors properly
+                for address, end, region in members:
+                    try:
+                        memory = memoryview(bytes(read_memory(address, end - address)))
+                        fetched[region] = region.fetch(*windows[region], memory=memory)
+                    except gdb.error as e:
+                        fetched[region] = region.error(e)
+                continue
+            for address, end, region in members:
+                fetched[region] = region.fetch(*windows[region], memory=memory[address - low:end - low])
+        regions = [(region, data or fetched[region]) for region, data in regions]
+        return {'regions': regions, 'per_line': per_line}
+
+    def format(self, data, term_width, term_height):
         out = []
-        for expression, region in self.table.items():
-            out.append(divider(term_width, expression))
-            out.extend(region.format(self.get_per_line(term_width)))
+        for region, region_data in data['regions']:
+            label = region.expression
+            # show the visible rows if the region does not fit
+            if 'error' not in region_data and region_data['end'] - region_data['start'] < region.length:
+                first = region_data['start'] // data['per_line']
+                last = -(-region_data['end'] // data['per_line'])
+                rows = -(-region.length // data['per_line'])
+                label += ' [{}-{}/{}]'.format(first + 1, last, rows)
+            out.append(divider(term_width, label))
+            out.extend(region.format(region_data, data['per_line']))
         return out
 
+    def record(self, data, term_width, term_height):
+        regions = []
+        stop_number = stop_context().stop_number()
+        for region, region_data in data['regions']:
+            if 'error' in region_data:
+                regions.append({'expression': region.expression, 'error': region_data['error']})
+                continue
+            start, end, low = region_data['start'], region_data['end'], region_data['low']
+            # runs of bytes written since the previous stop
+            runs = []
+            if region.timeline and region.timeline[-1][0] == stop_number:
+                runs = [[offset, len(content)] for offset, content in region.timeline[-1][1]]
+            regions.append({
+                'expression': region.expression,
+                'address': region_data['address'],
+                'offset': start,
+                'bytes': format_bytes(region_data['memory'][start - low:end - low], ''),
+                'changed': runs
+            })
+        return {'regions': regions}
+
     def commands(self):
         return {
             'watch': {
@@ -1916,6 +3727,22 @@ The length defaults to 16 bytes.''',
             'clear': {
                 'action': self.clear,
                 'doc': 'Clear all the watched regions.'
+            },
+            'scroll': {
+                'action': self.scroll,
+                'doc': '''Scroll a watched region by relative rows.
+
+Reset the scrolling if invoked without the number of rows.''',
+                'complete': gdb.COMPLETE_EXPRESSION
+            },
+            'history': {
+                'action': self.history,
+                'doc': '''Show the changes of a byte of a watched region.
+
+Specify the region expression and the offset of the byte within the region.
+Only the changes to the displayed rows are tracked (see the timeline
+attribute).''',
+                'complete': gdb.COMPLETE_EXPRESSION
             }
         }
 
@@ -1934,6 +3761,34 @@ The length defaults to 16 bytes.''',
             'placeholder': {
                 'doc': 'Placeholder used for missing items and unprintable characters.',
                 'default': '·'
+            },
+            'height': {
+                'doc': '''Maximum number of rows displayed for each region.
+
+Only the visible rows are read from the inferior memory, use the scroll
+command to move across large regions. A value of 0 displays the whole
+regions.''',
+                'default': 0,
+                'type': int,
+                'check': check_ge_zero
+            },
+            'timeline': {
+                'doc': '''Number of stops with changes remembered for each region.
+
+Only the changed bytes are stored for each stop. A value of 0 disables the
+tracking (see the history command).''',
+                'default': 1000,
+                'type': int,
+                'check': check_ge_zero
+            },
+            'gap': {
+                'doc': '''Maximum distance in bytes between regions read together.
+
+Overlapping or nearby regions are fetched with a single read to reduce the
+round-trips with remote targets.''',
+                'default': 64,
+                'type': int,
+                'check': check_ge_zero
             }
         }
 
@@ -1962,22 +3817,72 @@ The length defaults to 16 bytes.''',
     def clear(self, arg):
         self.table.clear()
 
-    def format_byte(self, byte):
-        # `type(byte) is bytes` in Python 3
-        if 0x20 < ord(byte) < 0x7f:
-            return chr(ord(byte))
+    def scroll(self, arg):
+        if arg:
+            expression, _, rows = arg.partition(' ')
+            region = self.table.get(expression)
+            if not region:
+                raise Exception('Memory expression not watched')
+            # the offset is clamped while rendering
+            if rows:
+                region.offset = max(region.offset + int(rows), 0)
+            else:
+                region.offset = 0
         else:
-            return self.placeholder[0]
+            raise Exception('Specify a matched memory expression')
+
+    def history(self, arg):
+        expression, _, offset = arg.partition(' ')
+        if not offset:
+            raise Exception('Specify a matched memory expression and an offset')
+        region = self.table.get(expression)
+        if not region:
+            raise Exception('Memory expression not watched')
+        offset = Memory.parse_as_address(offset)
+        if not 0 <= offset < region.length:
+            raise Exception('Offset out of the region')
+        original, writes = region.history(offset)
+        if original is not None:
+            print('{} original value'.format(ansi(HEX_BYTES[original], R.style_high)))
+        for stop, value in writes:
+            print('{} written at stop {}'.format(ansi(HEX_BYTES[value], R.style_selected_1), stop))
+        if writes:
+            print('Last written at stop {}'.format(writes[-1][0]))
+        elif original is None:
+            print('No change recorded')
+        else:
+            print('No write recorded')
+
+    def get_text_table(self):
+        # translation table from Latin-1 decoded bytes to printable characters
+        placeholder = self.placeholder[0]
+        if self.text_table is None or self.text_table[0] != placeholder:
+            table = {byte: placeholder for byte in range(256) if not 0x20 < byte < 0x7f}
+            self.text_table = (placeholder, table)
+        return self.text_table[1]
 
     def get_per_line(self, term_width):
         if self.full:
             padding = 3  # two double spaces separator (one is part of below)
             elem_size = 4 # HH + 1 space + T
-            address_length = gdb.parse_and_eval('$pc').type.sizeof * 2 + 2  # 0x
+            address_length = stop_context().pointer_size() * 2 + 2  # 0x
             return max(int((term_width - address_length - padding) / elem_size), 1)
         else:
             return Memory.DEFAULT_LENGTH
 
+    @staticmethod
+    def plan_reads(spans, gap):
+        # merge the (start, end, region) spans that overlap or are at most
+        # `gap` bytes apart in (low, high, spans) reads
+        reads = []
+        for span in sorted(spans, key=lambda span: span[0]):
+            if reads and span[0] <= reads[-1][1] + gap:
+                low, high, members = reads[-1]
+                reads[-1] = (low, max(high, span[1]), members + [span])
+            else:
+                reads.append((span[0], span[1], [span]))
+        return reads
+
     @staticmethod
     def parse_as_address(expression):
         value = gdb.parse_and_eval(expression)
@@ -1986,41 +3891,92 @@ The length defaults to 16 bytes.''',
 class Registers(Dashboard.Module):
     '''Show the CPU registers and their values.'''
 
+    # format string and mask by register size
+    FORMATS = {}
+
+    # struct format and lane format by lane type
+    LANES = {
+        'u8': ('B', '{:02x}'),
+        'u32': ('I', '{:08x}'),
+        'u64': ('Q', '{:016x}'),
+        'f32': ('f', '{:g}'),
+        'f64': ('d', '{:g}')
+    }
+
     def __init__(self):
         self.table = {}
+        self.descriptors = {}
+        self.byte_orders = {}
 
     def label(self):
         return 'Registers'
 
     def lines(self, term_width, term_height, style_changed):
+        data = self.collect(term_width, term_height, style_changed)
+        return self.format(data, term_width, term_height)
+
+    def collect(self, term_width, term_height, style_changed):
         # skip if the current thread is not stopped
-        if not gdb.selected_thread().is_stopped():
-            return []
+        context = stop_context()
+        if not context.is_stopped():
+            return None
         # obtain the registers to display
         if style_changed:
             self.table = {}
-        if self.register_list:
-            register_list = self.register_list.split()
-        else:
-            register_list = Registers.fetch_register_list()
-        # fetch registers status
+        registers = self.fetch_registers(context, self.table)
+        return {'registers': registers, 'column_major': self.column_major}
+
+    def fetch_registers(self, context, table):
+        # return the (name, value, changed) registers, the values of the
+        # previous stop are kept in the given table
+        frame = context.frame()
+        architecture = context.architecture()
         registers = []
-        for name in register_list:
-            # exclude registers with a dot '.' or parse_and_eval() will fail
-            if '.' in name:
+        for name, descriptor in self.fetch_descriptors(architecture):
+            try:
+                value = Registers.read_register(frame, name, descriptor)
+                # format vector registers as lanes from the raw bytes
+                if self.lanes and Registers.is_vector(value):
+                    raw = Registers.fetch_raw_bytes(value)
+                    if raw is not None and len(raw) % struct.calcsize(Registers.LANES[self.lanes][0]) == 0:
+                        lanes = self.format_lanes(raw, table.get(name), architecture)
+                        table[name] = raw
+                        registers.append((name,) + lanes)
+                        continue
+                string_value = Registers.format_value(value)
+            except gdb.error:
+                # report unknown names, skip the registers that cannot be read
+                # (e.g., unavailable in core files or tracepoint frames)
+                if descriptor is None:
+                    raise
                 continue
-            value = gdb.parse_and_eval('${}'.format(name))
-            string_value = Registers.format_value(value)
             # exclude unavailable registers (see #255)
             if string_value == '<unavailable>':
                 continue
-            changed = self.table and (self.table.get(name, '') != string_value)
-            self.table[name] = string_value
+            changed = bool(table) and table.get(name, '') != string_value
+            table[name] = string_value
             registers.append((name, string_value, changed))
+        return registers
+
+    def format(self, data, term_width, term_height):
+        if data is None:
+            return []
+        registers = data['registers']
         # handle the empty register list
         if not registers:
             msg = 'No registers to show (check the "dashboard registers -style list" attribute)'
             return [ansi(msg, R.style_error)]
+        # highlight the whole value or just the changed lanes
+        styled_registers = []
+        for name, value, changed in registers:
+            if type(value) is list:
+                styled_value = ' '.join(ansi(lane, R.style_selected_1) if lane_changed else lane
+                                        for lane, lane_changed in zip(value, changed))
+                value = ' '.join(value)
+            else:
+                styled_value = ansi(value, R.style_selected_1 if changed else '')
+            styled_registers.append((name, value, styled_value))
+        registers = styled_registers
         # compute lengths considering an extra space between and around the
         # entries (hence the +2 and term_width - 1)
         max_name = max(len(name) for name, _, _ in registers)
@@ -2029,7 +3985,7 @@ class Registers(Dashboard.Module):
         columns = min(int((term_width - 1) / max_width) or 1, len(registers))
         rows = int(math.ceil(float(len(registers)) / columns))
         # build the registers matrix
-        if self.column_major:
+        if data['column_major']:
             matrix = list(registers[i:i + rows] for i in range(0, len(registers), rows))
         else:
             matrix = list(registers[i::columns] for i in range(columns))
@@ -2052,15 +4008,21 @@ class Registers(Dashboard.Module):
         for i, column in enumerate(matrix):
             max_name = max_names_column[i]
             max_value = max_values_column[i]
-            for j, (name, value, changed) in enumerate(column):
+            for j, (name, value, styled_value) in enumerate(column):
                 name = ' ' * (max_name - len(name)) + ansi(name, R.style_low)
-                style = R.style_selected_1 if changed else ''
-                value = ansi(value, style) + ' ' * (max_value - len(value))
+                value = styled_value + ' ' * (max_value - len(value))
                 padding = ' ' * padding_column[i]
                 item = '{}{} {}'.format(padding, name, value)
                 out[j] += item
         return out
 
+    def record(self, data, term_width, term_height):
+        if data is None:
+            return None
+        # vector registers have lists of lanes and changed flags
+        return {'registers': [{'name': name, 'value': value, 'changed': changed}
+                              for name, value, changed in data['registers']]}
+
     def attributes(self):
         return {
             'column-major': {
@@ -2076,16 +4038,101 @@ The empty list (default) causes to show all the available registers. For
 architectures different from x86 setting this attribute might be mandatory.''',
                 'default': '',
                 'name': 'register_list',
+            },
+            'lanes': {
+                'doc': '''Lane type used to display the vector registers.
+
+One of "u8", "u32", "u64", "f32" or "f64", lanes are shown from the lowest and
+only the changed ones are highlighted. The empty string (default) uses the GDB
+representation. Vector registers usually need to be listed explicitly (see the
+list attribute).''',
+                'default': '',
+                'check': lambda lanes: not lanes or lanes in Registers.LANES
             }
         }
 
+    def fetch_descriptors(self, architecture):
+        # the list of (name, descriptor) is computed once per architecture,
+        # descriptors are None if Architecture.registers() is not available
+        key = (architecture.name(), self.register_list)
+        descriptors = self.descriptors.get(key)
+        if descriptors is None:
+            has_descriptors = hasattr(architecture, 'registers')
+            if self.register_list:
+                names = self.register_list.split()
+            elif has_descriptors:
+                names = [descriptor.name for descriptor in architecture.registers('general')]
+            else:
+                names = Registers.fetch_register_list()
+            # exclude registers with a dot '.' or parse_and_eval() will fail
+            names = [name for name in names if '.' not in name]
+            available = {}
+            if has_descriptors:
+                available = {descriptor.name: descriptor for descriptor in architecture.registers()}
+            descriptors = [(name, available.get(name)) for name in names]
+            self.descriptors[key] = descriptors
+        return descriptors
+
+    def format_lanes(self, raw, previous, architecture):
+        # return the formatted lanes and their changed status
+        lane_code, lane_format = Registers.LANES[self.lanes]
+        lane_size = struct.calcsize(lane_code)
+        count = len(raw) // lane_size
+        byte_order = self.byte_orders.get(architecture.name())
+        if byte_order is None:
+            byte_order = '>' if 'big endian' in run('show endian') else '<'
+            self.byte_orders[architecture.name()] = byte_order
+        values = struct.unpack('{}{}{}'.format(byte_order, count, lane_code), raw)
+        lanes = [lane_format.format(value) for value in values]
+        # compare the raw lanes so that NaNs are handled properly
+        if previous is None or len(previous) != len(raw):
+            changed = [False] * count
+        else:
+            changed = [raw[i:i + lane_size] != previous[i:i + lane_size]
+                       for i in range(0, len(raw), lane_size)]
+        return lanes, changed
+
+    @staticmethod
+    def is_vector(value):
+        code = value.type.code
+        return code == gdb.TYPE_CODE_UNION or (code == gdb.TYPE_CODE_ARRAY and value.type.sizeof >= 8)
+
+    @staticmethod
+    def fetch_raw_bytes(value):
+        # Value.bytes is a recent addition, otherwise look for a bytes array
+        # member (e.g., v16_int8 on x86)
+        try:
+            return bytes(value.bytes)
+        except AttributeError:
+            pass
+        if value.type.code == gdb.TYPE_CODE_UNION:
+            for field in value.type.fields():
+                field_type = field.type.strip_typedefs()
+                if (field_type.code == gdb.TYPE_CODE_ARRAY and
+                        field_type.target().sizeof == 1 and
+                        field_type.sizeof == value.type.sizeof):
+                    array = value[field.name]
+                    return bytes(bytearray(int(array[i]) & 0xff for i in range(field_type.sizeof)))
+        return None
+
+    @staticmethod
+    def read_register(frame, name, descriptor):
+        # read directly from the frame when possible, unknown names are
+        # evaluated to report the proper error
+        if descriptor is not None:
+            return frame.read_register(descriptor)
+        return gdb.parse_and_eval('${}'.format(name))
+
     @staticmethod
     def format_value(value):
         try:
             if value.type.code in [gdb.TYPE_CODE_INT, gdb.TYPE_CODE_PTR]:
-                int_value = to_unsigned(value, value.type.sizeof)
-                value_format = '0x{{:0{}x}}'.format(2 * value.type.sizeof)
-                return value_format.format(int_value)
+                size = value.type.sizeof
+                value_format = Registers.FORMATS.get(size)
+                if not value_format:
+                    value_format = ('0x{{:0{}x}}'.format(2 * size), (2 ** (size * 8)) - 1)
+                    Registers.FORMATS[size] = value_format
+                return value_format[0].format(int(value) & value_format[1])
         except (gdb.error, ValueError):
             # convert to unsigned but preserve code and flags information
             pass
@@ -2108,13 +4155,47 @@ architectures different from x86 setting this attribute might be mandatory.''',
         return names
 
 class Threads(Dashboard.Module):
-    '''List the currently available threads.'''
+    '''List the currently available threads.
+
+Optionally group the threads with identical stacks.'''
+
+    def __init__(self):
+        self.offset = 0
+        self.pc_lines = {}
+        self.stacks = {}
+        self.backtraces = {}
+        # stop number after which each thread (or all) has been resumed
+        self.resumed = {}
+        self.all_resumed = 0
+        gdb.events.cont.connect(self.on_continue)
+        # the fetched information is stale if the user changes registers or
+        # memory (e.g., `set $pc`) and redisplays
+        if hasattr(gdb.events, 'register_changed'):
+            gdb.events.register_changed.connect(self.on_change)
+        if hasattr(gdb.events, 'memory_changed'):
+            gdb.events.memory_changed.connect(self.on_change)
+
+    def on_continue(self, event):
+        # only the event thread is resumed in non-stop mode
+        thread = getattr(event, 'inferior_thread', None)
+        if thread:
+            self.resumed[(thread.inferior.num, thread.ptid)] = StopContext.stops
+        else:
+            self.resumed = {}
+            self.all_resumed = StopContext.stops
+
+    def on_change(self, _):
+        self.pc_lines = {}
+        self.stacks = {}
+        self.backtraces = {}
 
     def label(self):
         return 'Threads'
 
     def lines(self, term_width, term_height, style_changed):
-        out = []
+        if style_changed:
+            self.pc_lines = {}
+            self.backtraces = {}
         selected_thread = gdb.selected_thread()
         # do not restore the selected frame if the thread is not stopped
         restore_frame = gdb.selected_thread().is_stopped()
@@ -2125,35 +4206,172 @@ class Threads(Dashboard.Module):
         for inferior in gdb.inferiors():
             if self.all_inferiors or inferior == gdb.selected_inferior():
                 threads += gdb.Inferior.threads(inferior)
-        for thread in threads:
-            # skip running threads if requested
-            if self.skip_running and thread.is_running():
-                continue
+        # skip running threads if requested
+        if self.skip_running:
+            threads = [thread for thread in threads if not thread.is_running()]
+        # in all-stop mode with the scheduler locked only the selected thread
+        # may have run since the previous stop
+        self.locked = Threads.is_scheduler_locked()
+        self.switched = False
+        if self.unique:
+            out = self.group_threads(threads, selected_thread)
+        else:
+            out = self.list_threads(threads, selected_thread)
+        # forget the threads that are gone
+        alive = set((thread.inferior.num, thread.ptid) for thread in threads)
+        for cache in (self.pc_lines, self.stacks, self.resumed):
+            for key in list(cache):
+                if key not in alive:
+                    del cache[key]
+        # restore thread and frame
+        if self.switched:
+            selected_thread.switch()
+            if restore_frame:
+                selected_frame.select()
+        return out
+
+    def list_threads(self, threads, selected_thread):
+        out = []
+        # only fetch the information of the visible threads
+        visible = self.visible(threads)
+        if self.offset:
+            out.append('[{}]'.format(ansi('+', R.style_selected_2)))
+        for thread in visible:
             is_selected = (thread.ptid == selected_thread.ptid)
             style = R.style_selected_1 if is_selected else R.style_selected_2
-            if self.all_inferiors:
-                number = '{}.{}'.format(thread.inferior.num, thread.num)
-            else:
-                number = str(thread.num)
-            number = ansi(number, style)
+            number = ansi(self.thread_number(thread), style)
             tid = ansi(str(thread.ptid[1] or thread.ptid[2]), style)
             info = '[{}] id {}'.format(number, tid)
             if thread.name:
                 info += ' name {}'.format(ansi(thread.name, style))
+            # reuse the PC line fetched in the same stop or, if the thread has
+            # not run, in a previous stop (the selected thread needs no switch)
+            key = (thread.inferior.num, thread.ptid)
+            cached = self.pc_lines.get(key)
+            if cached and cached[1] == (style, R.ansi) and not is_selected and self.is_valid(cached[0], key, is_selected):
+                out.append('{} {}'.format(info, cached[2]))
+                continue
             # switch thread to fetch info (unless is running in non-stop mode)
             try:
-                thread.switch()
+                if not is_selected:
+                    self.switched = True
+                    thread.switch()
                 frame = gdb.newest_frame()
-                info += ' ' + Stack.get_pc_line(frame, style)
+                pc_line = Stack.get_pc_line(frame, style)
+                self.pc_lines[key] = (stop_context().stop_number(), (style, R.ansi), pc_line)
+                info += ' ' + pc_line
             except gdb.error:
                 info += ' (running)'
             out.append(info)
-        # restore thread and frame
-        selected_thread.switch()
-        if restore_frame:
-            selected_frame.select()
+        if self.offset + len(visible) < len(threads):
+            out.append('[{}]'.format(ansi('+', R.style_selected_2)))
         return out
 
+    def group_threads(self, threads, selected_thread):
+        # group the threads by the PCs of the innermost frames (running
+        # threads have no stack)
+        groups = collections.OrderedDict()
+        for thread in threads:
+            is_selected = (thread.ptid == selected_thread.ptid)
+            stack = self.fetch_stack(thread, is_selected)
+            groups.setdefault(stack, []).append(thread)
+        # show the largest groups first
+        groups = sorted(groups.items(), key=lambda group: -len(group[1]))
+        out = []
+        visible = self.visible(groups)
+        if self.offset:
+            out.append('[{}]'.format(ansi('+', R.style_selected_2)))
+        backtraces = {}
+        for stack, group in visible:
+            is_selected = any(thread.ptid == selected_thread.ptid for thread in group)
+            style = R.style_selected_1 if is_selected else R.style_selected_2
+            count = ansi(str(len(group)), style)
+            numbers = ansi(Threads.format_numbers(self.thread_number(thread) for thread in group), style)
+            out.append('[{}] threads {}'.format(count, numbers))
+            if stack is None:
+                out.append(Stack.format_line('   ', '(running)'))
+                continue
+            # the backtrace of the first thread represents the whole group
+            backtrace = backtraces[stack] = self.backtraces.get(stack) or self.fetch_backtrace(group[0])
+            out.extend(backtrace)
+        self.backtraces = backtraces
+        if self.offset + len(visible) < len(groups):
+            out.append('[{}]'.format(ansi('+', R.style_selected_2)))
+        return out
+
+    def fetch_stack(self, thread, is_selected):
+        # return the tuple of the PCs of the innermost frames of the thread,
+        # plus whether there are more frames, or None if running
+        key = (thread.inferior.num, thread.ptid)
+        cached = self.stacks.get(key)
+        if cached and cached[0] == self.depth and self.is_valid(cached[1], key, is_selected):
+            return cached[3]
+        try:
+            if not is_selected:
+                self.switched = True
+                thread.switch()
+            frame = gdb.newest_frame()
+            # the stack fetched in a previous stop is reused without unwinding
+            # if the innermost frame is the same (e.g., blocked threads)
+            try:
+                innermost = (frame.pc(), int(frame.read_register('sp')))
+            except (gdb.error, ValueError):
+                innermost = None
+            if cached and cached[0] == self.depth and innermost and cached[2] == innermost:
+                stack = cached[3]
+            else:
+                pcs = []
+                while frame and len(pcs) < self.depth:
+                    pcs.append(frame.pc())
+                    frame = older_frame(frame)
+                stack = (tuple(pcs), frame is not None)
+        except gdb.error:
+            innermost = None
+            stack = None
+        self.stacks[key] = (self.depth, stop_context().stop_number(), innermost, stack)
+        return stack
+
+    def fetch_backtrace(self, thread):
+        self.switched = True
+        thread.switch()
+        backtrace = []
+        frame = gdb.newest_frame()
+        while frame and len(backtrace) < self.depth:
+            frame_id = ansi(str(len(backtrace)), R.style_selected_2)
+            info = Stack.get_pc_line(frame, R.style_selected_2)
+            backtrace.append(Stack.format_line('   ', '[{}] {}'.format(frame_id, info)))
+            frame = older_frame(frame)
+        # add the placeholder
+        if frame:
+            backtrace.append(Stack.format_line('   ', '[{}]'.format(ansi('+', R.style_selected_2))))
+        return backtrace
+
+    def visible(self, items):
+        height = self.height or len(items)
+        self.offset = max(min(self.offset, len(items) - height), 0)
+        return items[self.offset:self.offset + height]
+
+    def is_valid(self, stop_number, key, is_selected):
+        # the information is valid if fetched in the same stop or if the thread
+        # has not been resumed since then
+        if stop_number == stop_context().stop_number() or (self.locked and not is_selected):
+            return True
+        return stop_number > max(self.all_resumed, self.resumed.get(key, -1))
+
+    def thread_number(self, thread):
+        if self.all_inferiors:
+            return '{}.{}'.format(thread.inferior.num, thread.num)
+        else:
+            return str(thread.num)
+
+    def commands(self):
+        return {
+            'scroll': {
+                'action': self.scroll,
+                'doc': 'Scroll by relative steps or reset if invoked without argument.'
+            }
+        }
+
     def attributes(self):
         return {
             'skip-running': {
@@ -2168,13 +4386,149 @@ class Threads(Dashboard.Module):
                 'name': 'all_inferiors',
                 'type': bool
             },
+            'height': {
+                'doc': '''Maximum number of displayed threads (or groups).
+
+Only the information about the displayed threads is fetched, use the scroll
+command to move across the list. A value of 0 displays all the threads.''',
+                'default': 0,
+                'type': int,
+                'check': check_ge_zero
+            },
+            'unique': {
+                'doc': '''Group the threads with identical stacks.
+
+Threads are grouped by the PCs of their innermost frames (see the depth
+attribute), each group shows the number of threads and the backtrace of one
+of them.''',
+                'default': False,
+                'type': bool
+            },
+            'depth': {
+                'doc': 'Number of frames compared to group the threads.',
+                'default': 8,
+                'type': int,
+                'check': check_gt_zero
+            }
         }
 
+    def scroll(self, arg):
+        # the offset is clamped while rendering
+        if arg:
+            self.offset = max(self.offset + int(arg), 0)
+        else:
+            self.offset = 0
+
+    @staticmethod
+    def is_scheduler_locked():
+        try:
+            return not gdb.parameter('non-stop') and gdb.parameter('scheduler-locking') == 'on'
+        except (gdb.error, RuntimeError):
+            return False
+
+    @staticmethod
+    def format_numbers(numbers):
+        # collapse the consecutive thread numbers in ranges
+        ranges = []
+        for number in numbers:
+            prefix, _, last = number.rpartition('.')
+            if ranges and ranges[-1][0] == prefix and ranges[-1][2] + 1 == int(last):
+                ranges[-1][2] = int(last)
+            else:
+                ranges.append([prefix, int(last), int(last)])
+        items = []
+        for prefix, first, last in ranges:
+            prefix = prefix + '.' if prefix else ''
+            if first == last:
+                items.append('{}{}'.format(prefix, first))
+            else:
+                items.append('{}{}-{}'.format(prefix, first, last))
+        return ','.join(items)
+
 class Expressions():
-    '''Watch user expressions.'''
+    '''Watch user expressions.
+
+Optionally trace them at a location without stopping the execution.'''
+
+    # print command format letters by radix
+    FORMAT_LETTERS = {2: 't', 8: 'o', 10: 'd', 16: 'x'}
+
+    # type codes whose formatting does not depend on the output radix
+    RADIX_INDEPENDENT = (gdb.TYPE_CODE_PTR, gdb.TYPE_CODE_ENUM, gdb.TYPE_CODE_BOOL, gdb.TYPE_CODE_CHAR)
+
+    class Tracepoint(gdb.Breakpoint):
+        def __init__(self, location, trace):
+            gdb.Breakpoint.__init__(self, location)
+            self.trace = trace
+
+        def stop(self):
+            # sample and let the execution continue
+            self.trace.sample()
+            return False
+
+    class Trace():
+        '''Ring buffer of the samples of the watched expressions.
+
+        Timestamps and values are stored as doubles in preallocated arrays,
+        values that are not numbers are stored as NaN.'''
+
+        def __init__(self, location, expressions, size):
+            self.location = location
+            self.expressions = expressions
+            self.size = size
+            self.count = 0
+            self.start = time.time()
+            self.times = array.array('d', [0.0]) * size
+            self.columns = [array.array('d', [0.0]) * size for _ in expressions]
+            self.tracepoint = Expressions.Tracepoint(location, self)
+
+        def is_active(self):
+            return self.tracepoint is not None and self.tracepoint.is_valid()
+
+        def stop(self):
+            if self.is_active():
+                self.tracepoint.delete()
+            self.tracepoint = None
+
+        def sample(self):
+            index = self.count % self.size
+            self.times[index] = time.time() - self.start
+            for column, (_, expression) in zip(self.columns, self.expressions):
+                try:
+                    value = gdb.parse_and_eval(expression)
+                    if value.type.strip_typedefs().code == gdb.TYPE_CODE_FLT:
+                        column[index] = float(value)
+                    else:
+                        column[index] = float(int(value))
+                except (gdb.error, TypeError, ValueError):
+                    column[index] = float('nan')
+            self.count += 1
+
+        def rows(self, limit):
+            # return the (number, time, values) of the latest samples
+            first = max(self.count - min(limit, self.size), 0)
+            for number in range(first, self.count):
+                index = number % self.size
+                yield number + 1, self.times[index], [column[index] for column in self.columns]
+
+        def summary(self):
+            # return the (valid samples, min, max, mean, last) of each column
+            stored = min(self.count, self.size)
+            last = (self.count - 1) % self.size
+            stats = []
+            for column in self.columns:
+                values = [value for value in column[:stored] if not math.isnan(value)]
+                if values:
+                    stats.append((len(values), min(values), max(values),
+                                  math.fsum(values) / len(values), column[last]))
+                else:
+                    stats.append((0, None, None, None, None))
+            return stats
 
     def __init__(self):
         self.table = []
+        self.parsed = {}
+        self.trace = None
 
     def label(self):
         return 'Expressions'
@@ -2184,26 +4538,69 @@ class Expressions():
         label_width = 0
         if self.align:
             label_width = max(len(expression) for expression in self.table) if self.table else 0
-        default_radix = Expressions.get_default_radix()
         for number, expression in enumerate(self.table, start=1):
-            label = expression
-            match = re.match(r'^/(\d+) +(.+)$', expression)
+            radix, expression = self.parse(expression)
             try:
-                if match:
-                    radix, expression = match.groups()
-                    run('set output-radix {}'.format(radix))
-                value = format_value(gdb.parse_and_eval(expression))
+                value = Expressions.format_radix(gdb.parse_and_eval(expression), radix)
             except gdb.error as e:
                 value = ansi(e, R.style_error)
-            finally:
-                if match:
-                    run('set output-radix {}'.format(default_radix))
             number = ansi(str(number), R.style_selected_2)
             label = ansi(expression, R.style_high) + ' ' * (label_width - len(expression))
             equal = ansi('=', R.style_low)
             out.append('[{}] {} {} {}'.format(number, label, equal, value))
+        # show the collected samples, if any
+        if self.trace:
+            out.extend(self.format_trace(term_width))
         return out
 
+    def format_trace(self, term_width):
+        trace = self.trace
+        status = 'tracing' if trace.is_active() else 'stopped'
+        label = 'Trace at {} ({}, {} samples)'.format(trace.location, status, trace.count)
+        out = [divider(term_width, label)]
+        names = [expression for _, expression in trace.expressions]
+        radixes = [radix for radix, _ in trace.expressions]
+        if self.trace_summary:
+            # one row per expression
+            name_width = max(len(name) for name in names) if names else 0
+            for name, radix, (count, low, high, mean, last) in zip(names, radixes, trace.summary()):
+                name = ansi(name, R.style_high) + ' ' * (name_width - len(name))
+                if count:
+                    stats = 'min {} max {} mean {} last {}'.format(
+                        *(ansi(Expressions.format_sample(x, radix), R.style_selected_2) for x in (low, high, mean, last)))
+                else:
+                    stats = ansi('no numeric samples', R.style_low)
+                out.append('{} {} {}'.format(name, ansi('=', R.style_low), stats))
+        else:
+            # one row per sample, oldest first
+            rows = []
+            for number, timestamp, values in trace.rows(self.trace_rows):
+                row = [str(number), '{:.6f}'.format(timestamp)]
+                row.extend(Expressions.format_sample(value, radix) for value, radix in zip(values, radixes))
+                rows.append(row)
+            header = ['#', 'time'] + names
+            widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+            out.append(' '.join(ansi(cell.rjust(width), R.style_high) for cell, width in zip(header, widths)))
+            for row in rows:
+                cells = [ansi(row[0].rjust(widths[0]), R.style_selected_2), ansi(row[1].rjust(widths[1]), R.style_low)]
+                cells.extend(cell.rjust(width) for cell, width in zip(row[2:], widths[2:]))
+                out.append(' '.join(cells))
+        return out
+
+    # integer formats by radix
+    RADIX_FORMATS = {2: '0b{:b}', 8: '0{:o}', 10: '{:d}', 16: '0x{:x}'}
+
+    @staticmethod
+    def format_sample(value, radix=None):
+        if value is None or math.isnan(value):
+            return '-'
+        if value.is_integer() and abs(value) < 2 ** 53:
+            # the size of the samples is not known so the negative ones are
+            # shown in decimal instead of masked
+            value_format = Expressions.RADIX_FORMATS.get(radix if value >= 0 else 10, '{:d}')
+            return value_format.format(int(value))
+        return '{:g}'.format(value)
+
     def commands(self):
         return {
             'watch': {
@@ -2217,7 +4614,20 @@ class Expressions():
             },
             'clear': {
                 'action': self.clear,
-                'doc': 'Clear all the watched expressions.'
+                'doc': 'Clear all the watched expressions and the trace.'
+            },
+            'trace': {
+                'action': self.start_trace,
+                'doc': '''Trace the watched expressions at a location without stopping.
+
+Each time the location is hit the watched expressions are sampled and the
+execution continues, the samples are displayed at the next stop. Tracing again
+discards the previous samples.''',
+                'complete': gdb.COMPLETE_LOCATION
+            },
+            'untrace': {
+                'action': self.stop_trace,
+                'doc': 'Stop tracing but keep the collected samples.'
             }
         }
 
@@ -2227,6 +4637,26 @@ class Expressions():
                 'doc': 'Align variables in column flag.',
                 'default': False,
                 'type': bool
+            },
+            'trace-size': {
+                'doc': 'Maximum number of samples kept by the trace, the oldest are overwritten.',
+                'default': 100000,
+                'name': 'trace_size',
+                'type': int,
+                'check': check_gt_zero
+            },
+            'trace-rows': {
+                'doc': 'Number of the latest samples displayed.',
+                'default': 10,
+                'name': 'trace_rows',
+                'type': int,
+                'check': check_ge_zero
+            },
+            'trace-summary': {
+                'doc': 'Display statistics of the samples instead of the samples themselves.',
+                'default': False,
+                'name': 'trace_summary',
+                'type': bool
             }
         }
 
@@ -2246,7 +4676,7 @@ class Expressions():
             except:
                 number = -1
             if 0 <= number < len(self.table):
-                self.table.pop(number)
+                self.parsed.pop(self.table.pop(number), None)
             else:
                 raise Exception('Expression not watched')
         else:
@@ -2254,6 +4684,64 @@ class Expressions():
 
     def clear(self, arg):
         self.table.clear()
+        self.parsed.clear()
+        if self.trace:
+            self.trace.stop()
+            self.trace = None
+
+    def start_trace(self, arg):
+        if not arg:
+            raise Exception('Specify a location')
+        if not self.table:
+            raise Exception('No expression watched')
+        expressions = [self.parse(expression) for expression in self.table]
+        if self.trace:
+            self.trace.stop()
+        self.trace = Expressions.Trace(arg, expressions, self.trace_size)
+
+    def stop_trace(self, arg):
+        if not self.trace or not self.trace.is_active():
+            raise Exception('Not tracing')
+        self.trace.stop()
+
+    def parse(self, expression):
+        # split the optional radix from the expression, once
+        parsed = self.parsed.get(expression)
+        if not parsed:
+            match = re.match(r'^/(\d+) +(.+)$', expression)
+            parsed = (int(match.group(1)), match.group(2)) if match else (None, expression)
+            self.parsed[expression] = parsed
+        return parsed
+
+    @staticmethod
+    def format_radix(value, radix):
+        if radix is None:
+            return format_value(value)
+        # format integers directly in the requested radix, the format letter
+        # would also apply to the bits of floats and to the characters of
+        # strings, which are instead affected by the output radix only
+        # partially (e.g., pointed strings, dereferenced values)
+        format_letter = Expressions.FORMAT_LETTERS.get(radix)
+        value_type = value.type.strip_typedefs()
+        if format_letter and value_type.code == gdb.TYPE_CODE_INT and not str(value_type).endswith('char'):
+            if hasattr(value, 'format_string'):
+                return format_value(value, format_letter=format_letter)
+            # format manually with older GDB
+            integer = to_unsigned(value, value.type.sizeof) if radix != 10 else int(value)
+            return Expressions.RADIX_FORMATS[radix].format(integer)
+        # pointers (always hexadecimal), enums, booleans and characters are
+        # formatted directly as the output radix hardly affects them
+        if value_type.code in Expressions.RADIX_INDEPENDENT or value_type.code == gdb.TYPE_CODE_INT:
+            return format_value(value)
+        # fall back to temporarily changing the output radix, if needed
+        default_radix = stop_context().memoize('output_radix', Expressions.get_default_radix)
+        if int(default_radix) == radix:
+            return format_value(value)
+        run('set output-radix {}'.format(radix))
+        try:
+            return format_value(value)
+        finally:
+            run('set output-radix {}'.format(default_radix))
 
     @staticmethod
     def get_default_radix():
@@ -2284,8 +4772,14 @@ class Breakpoints(Dashboard.Module):
         return 'Breakpoints'
 
     def lines(self, term_width, term_height, style_changed):
+        data = self.collect(term_width, term_height, style_changed)
+        return self.format(data, term_width, term_height)
+
+    def collect(self, term_width, term_height, style_changed):
+        return stop_context().breakpoints(watchpoints=True, pending=self.show_pending)
+
+    def format(self, breakpoints, term_width, term_height):
         out = []
-        breakpoints = fetch_breakpoints(watchpoints=True, pending=self.show_pending)
         for breakpoint in breakpoints:
             sub_lines = []
             # format common information
@@ -2348,6 +4842,10 @@ class Breakpoints(Dashboard.Module):
             out.extend(sub_lines)
         return out
 
+    def record(self, breakpoints, term_width, term_height):
+        return {'breakpoints': [dict(breakpoint, type=Breakpoints.NAMES.get(breakpoint['type'], breakpoint['type']))
+                                for breakpoint in breakpoints]}
+
     def attributes(self):
         return {
             'pending': {